@@ -2,3 +2,4 @@
 from .action import action
 from .concurrency import *
 from .signals import *
+from .clock import WallClock, SimulatedClock, get_clock, set_clock
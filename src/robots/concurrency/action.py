@@ -3,13 +3,17 @@ import logging; logger = logging.getLogger("robots.actions")
 import time
 
 import threading
+import inspect
+from functools import partial
 
 import robots
 from robots.introspection import introspection
-from .signals import ActionCancelled
-from .concurrency import FakeFuture
+from .signals import ActionCancelled, ActionRejected
+from .concurrency import FakeFuture, ProgressQueue, RobotActionExecutor, set_thread_status, shielded_caller, stream_progress
 
-def action(fn):
+def action(fn = None, coroutine = False, process = False, priority = 0, preempt = False, timeout = None,
+           progress_buffer = 16, progress_policy = ProgressQueue.DROP_OLDEST, inline = False,
+           coalesce = None):
     """ When applied to a function, this decorator turns it into
     a asynchronous task, starts it in a different thread, and returns
     a 'future' object that can be used to query the result/cancel it/etc.
@@ -43,110 +47,322 @@ def action(fn):
     This sends the signal :class:`.ActionCancelled` to the
     action, that can appropriately terminate.
 
+    The decorator accepts options (``@action(...)``):
+
+    :param coroutine: (default: False) if ``True``, the action must be a
+      generator function. It is then executed as a lightweight coroutine on
+      the robot's coroutine loop instead of in its own thread. Cf
+      :mod:`robots.concurrency.coroutines`.
+    :param process: (default: False) if ``True``, the body of the action is
+      executed in a separate process, to not hold the GIL of the robot
+      controller. Cf :mod:`robots.concurrency.processes`.
+    :param priority: (default: 0) priority of the action. When several
+      actions wait for the same resource, the resource is granted to the
+      action with the highest priority first. In pooled mode (cf
+      :class:`.RobotActionExecutor`), queued actions are also started by
+      order of priority.
+    :param preempt: (default: False) if ``True``, the action *cancels* the
+      actions of lower priority that hold a resource it needs, instead of
+      waiting for them to complete.
+
+    .. code-block:: python
+
+        @action(priority = 10, preempt = True)
+        @lock(WHEELS)
+        def emergency_stop(robot):
+            # cancels the navigation actions holding the wheels, if any
+            ...
+
+    :param timeout: (default: None) if set, the action is cancelled if it
+      is still running ``timeout`` seconds after its submission (this
+      includes the time spent waiting for resources). The deadline of a
+      given call can be changed with :meth:`.RobotAction.set_timeout`.
+
+    .. code-block:: python
+
+        @action(timeout = 30)
+        def goto(robot, target):
+            ...
+
+        a = robot.goto(kitchen)
+        a.set_timeout(60) # this one may take longer
+        a.wait()
+        if a.timed_out:
+            ...
+
+    If the action is a generator function (and not a coroutine), the values
+    it yields are streamed to the callers of :meth:`.RobotAction.progress`
+    (the result of the action is the value passed to ``StopIteration``, if
+    any). The action is cancellable at every ``yield``.
+
+    .. code-block:: python
+
+        @action
+        def goto(robot, target):
+            while not arrived:
+                ...
+                yield remaining_distance
+
+        for distance in robot.goto(kitchen).progress():
+            ...
+
+    :param progress_buffer: (default: 16) maximum number of yielded values
+      waiting to be read.
+    :param progress_policy: (default: ``ProgressQueue.DROP_OLDEST``) what
+      to do when the values are not read fast enough:
+      ``ProgressQueue.DROP_OLDEST`` discards the oldest value,
+      ``ProgressQueue.BLOCK`` suspends the action until a value is read.
+
+    :param inline: (default: False) if ``True``, the action is executed
+      synchronously, in the thread of the caller, and the returned future
+      (an :class:`.InlineAction`) is already completed. This avoids the cost
+      of a thread and of the registration of the action, for tiny actions
+      (getters, setters...). Inline actions can not lock resources, nor be
+      coroutines, generators, executed in a separate process or have a
+      timeout. Called from another action, an inline action runs as part of
+      it: cancelling the enclosing action interrupts the inline one.
+
+    .. code-block:: python
+
+        @action(inline = True)
+        def set_speed(robot, speed):
+            robot.state["speed"] = speed
+
+        robot.set_speed(0.5).result() # already done
+
+    :param coalesce: (default: None) what to do when the action is called
+      while a previous call *with the same arguments* is still running:
+
+      - ``RobotActionExecutor.JOIN``: returns the future of the running call,
+      - ``RobotActionExecutor.REPLACE``: cancels the running call (without
+        waiting for it), and starts the new one,
+      - ``RobotActionExecutor.DROP``: ignores the new call (the returned
+        future is completed, with ``None`` as result).
+
+      Calls whose arguments are not hashable are never coalesced. Cf
+      :meth:`.RobotActionExecutor.coalesce`.
+
+    .. code-block:: python
+
+        @action(coalesce = RobotActionExecutor.JOIN)
+        @lock(HEAD)
+        def look_at(robot, target):
+            ...
+
+        # called at 10Hz by an event callback: one single look_at("person")
+        # runs at a time
+        robot.look_at("person")
     """
 
+    if fn is None:
+        # decorator used with options: @action(...)
+        return partial(action, coroutine = coroutine, process = process,
+                       priority = priority, preempt = preempt, timeout = timeout,
+                       progress_buffer = progress_buffer, progress_policy = progress_policy,
+                       inline = inline, coalesce = coalesce)
+
+    if coroutine and not inspect.isgeneratorfunction(fn):
+        raise TypeError("Action <%s> is declared as a coroutine, but is not a generator function" % fn.__name__)
+
+    if coroutine and process:
+        raise TypeError("Action <%s> can not be both a coroutine and executed in a separate process" % fn.__name__)
+
+    # generator actions stream their progress
+    streaming = not coroutine and inspect.isgeneratorfunction(fn)
+
+    if inline and (coroutine or process or streaming or timeout is not None):
+        raise TypeError("Inline action <%s> can not be a coroutine, a generator, executed in a separate process or have a timeout" % fn.__name__)
+
+    if coalesce not in (None, RobotActionExecutor.JOIN, RobotActionExecutor.REPLACE, RobotActionExecutor.DROP):
+        raise ValueError("Action <%s>: unknown coalescing policy %s" % (fn.__name__, coalesce))
+
+    if inline and coalesce is not None:
+        raise TypeError("Inline action <%s> can not be coalesced (it completes before returning)" % fn.__name__)
+
+    if inline and getattr(fn, "_locked_res", None):
+        raise TypeError("Inline action <%s> can not lock resources" % fn.__name__)
+
+    if streaming and process:
+        raise TypeError("Generator action <%s> can not be executed in a separate process" % fn.__name__)
+
+    if coroutine:
+        # coroutines are directly submitted to the executor (cf innerfunc)
+        fn._priority = priority
+        fn._preempt = preempt
+        fn._timeout = timeout
+
+    if process:
+        # the action thread only dispatches the call to a worker process
+        # (and holds the locked resources meanwhile)
+        def body(robot, *args, **kwargs):
+            return robot.executor.run_in_process(fn, args, kwargs)
+    else:
+        body = fn
+
     # wrapper for the original function that locks/unlocks shared
     # resources
-    def lockawarefn(future,actionname,*args, **kwargs):
+    def lockawarefn(future, *args, **kwargs):
+
+        locked_res = getattr(fn, "_locked_res", [])
+
+        # resources we do not wait for have been acquired at submission
+        acquired = [res for res, wait in locked_res if not wait]
 
         try:
             # we acquire resources *within the future thread* that
             # we want to *wait* for.
-            if hasattr(fn, "_locked_res"):
-                for res, wait in fn._locked_res:
-                    if wait:
-                        threading.current_thread().name = "Robot Action %s, waiting on resource %s" % (actionname, res) #fn.__name__
-                        need_to_wait = False
-                        if res.owner is not None:
-                            need_to_wait = True
-                            logger.info("Robot action <%s> is waiting on resource %s" % (actionname, res)) #fn.__name__
-                        res.acquire(wait, acquirer = fn.__name__)
-                        if need_to_wait:
-                            logger.info("Robot action <%s> has acquired resource %s" % (actionname, res)) #fn.__name__
-                        else:
-                            logger.info("Robot action <%s> acquired free resource %s  " %(actionname, res))
+            for res, wait in locked_res:
+                if wait:
+                    set_thread_status("Robot Action %s, waiting on resource %s", future, res)
+                    need_to_wait = False
+                    if res.owner is not None:
+                        need_to_wait = True
+                        logger.info("Robot action <%s> is waiting on resource %s", future, res)
+                        args[0].executor.waiting_for_resources(future) # args[0] is the robot
+                    res.acquire(wait, acquirer = fn.__name__,
+                                priority = priority, preempt = preempt, action = future)
+                    acquired.append(res)
+                    if need_to_wait:
+                        logger.info("Robot action <%s> has acquired resource %s", future, res)
+                    else:
+                        logger.info("Robot action <%s> acquired free resource %s", future, res)
 
         except ActionCancelled:
             # action cancelled while it was waiting for a resource to become
-            # available
-            threading.current_thread().name = "Idle Robot action thread"
-            logger.debug("Action <%s> cancelled while it was waiting for a lock on a resource." % actionname) #fn.__name__
+            # available: release the ones already acquired
+            for res in acquired:
+                res.release()
+            set_thread_status("Idle Robot action thread")
+            logger.debug("Action <%s> cancelled while it was waiting for a lock on a resource.", future)
             return None
  
         try:
-            future.has_acquired_resource = True
-            threading.current_thread().name = "Robot Action %s (running)" % actionname #fn.__name__
-            logger.debug("Starting action <%s> now." % actionname) #fn.__name__
+            args[0].executor.resources_acquired(future) # args[0] is the robot
+            set_thread_status("Robot Action %s (running)", future)
+            logger.debug("Starting action <%s> now.", future)
             try:
-                result = fn(*args, **kwargs)
+                result = body(*args, **kwargs)
             except TypeError:
-                logger.error("Exception when invoking action <%s>. Did you forget to add the parameter 'robot'?" % actionname) #fn.__name__
+                logger.error("Exception when invoking action <%s>. Did you forget to add the parameter 'robot'?", future)
                 raise
 
-            logger.debug("Action <%s> returned." % actionname) #fn.__name__
+            if streaming:
+                result = stream_progress(future, result)
+
+            logger.debug("Action <%s> returned.", future)
             return result
         except ActionCancelled:
-            logger.warning("Action cancellation ignored by %s. Forced stop!" % actionname) #fn.__name__
+            logger.warning("Action cancellation ignored by %s. Forced stop!", future)
         finally:
-            if hasattr(fn, "_locked_res"):
-                for res, wait in fn._locked_res:
-                    res.release()
+            for res in acquired:
+                res.release()
 
-            threading.current_thread().name = "Idle Robot action thread"
+            set_thread_status("Idle Robot action thread")
 
 
     lockawarefn.__name__ = fn.__name__
     lockawarefn.__doc__ = fn.__doc__
+    lockawarefn._priority = priority
+    lockawarefn._preempt = preempt
+    lockawarefn._timeout = timeout
+    if streaming:
+        lockawarefn._progress = (progress_buffer, progress_policy)
 
 
-    # wrapper that submits the function to the executor and returns
-    # a future.
-    def innerfunc(*args, **kwargs):
+    # submits the function to the executor and returns a future.
+    def submit(*args, **kwargs):
 
-        if len(args) == 0 or not isinstance(args[0], robots.GenericRobot):
-            raise Exception("No robot instance passed to the action!")
-        
         robot = args[0]
 
         # we acquire resources *outside the future* (to fail fast)
         # for resources we do not want to wait for.
+        acquired = []
         if hasattr(fn, "_locked_res"):
             for res, wait in fn._locked_res:
                 if not wait:
                     got_the_lock = res.acquire(False, acquirer = fn.__name__)
 
                     if not got_the_lock:
-                        logger.info("Required resource <%s> locked while attempting to start %s. Cancelling it as required." % (res.name, fn.__name__))
+                        logger.info("Required resource <%s> locked while attempting to start %s. Cancelling it as required.", res.name, fn.__name__)
+                        for r in acquired:
+                            r.release()
                         return FakeFuture(None)
+                    acquired.append(res)
 
-        if robot.immediate:
+        if robot.immediate and not coroutine:
             res = FakeFuture(lockawarefn(*args, **kwargs))
             return res
 
-        else:
-            executor = robot.executor
+        executor = robot.executor
 
-            if args and kwargs:
+        try:
+            if coroutine:
+                future = executor.submit_coroutine(fn, *args, **kwargs)
+            elif args and kwargs:
                 future = executor.submit(lockawarefn, *args, **kwargs)
             elif args:
                 future = executor.submit(lockawarefn, *args)
             else:
                 future = executor.submit(lockawarefn)
+        except ActionRejected:
+            for res in acquired:
+                res.release()
+            raise
+
+        if acquired:
+            # the action releases these resources when it completes. If it
+            # never runs (dropped by the admission control, or cancelled
+            # before starting), they must be released here.
+            def release_unstarted(future):
+                if future.cancelled():
+                    for res in acquired:
+                        res.release()
+            future.add_done_callback(release_unstarted)
+
+        if coroutine:
+            if robot.immediate:
+                return FakeFuture(future.result())
+            return future
 
-            if introspection:
+        if introspection:
 
-                introspection.action_started(fn.__name__, 
-                                            str("FUTURE ID BROKEN"),
-                                            str("ACTION ID BROKEN TDB"), #id of the current action
-                                            args[1:],
-                                            kwargs)
-                future.add_done_callback(lambda x : introspection.action_completed(fn.__name__, str("future.id BROKEN")))
+            introspection.action_started(fn.__name__, 
+                                        str("FUTURE ID BROKEN"),
+                                        str("ACTION ID BROKEN TDB"), #id of the current action
+                                        args[1:],
+                                        kwargs)
+            future.add_done_callback(lambda x : introspection.action_completed(fn.__name__, str("future.id BROKEN")))
 
-            return future
+        return future
+
+    # wrapper that checks the robot instance, and dispatches the call
+    def innerfunc(*args, **kwargs):
+
+        if len(args) == 0 or not isinstance(args[0], robots.GenericRobot):
+            raise Exception("No robot instance passed to the action!")
+        
+        robot = args[0]
+
+        if inline:
+            return robot.executor.run_inline(fn, args, kwargs)
+
+        if robot.immediate: # executed synchronously
+            return submit(*args, **kwargs)
+
+        # a cancellation of the calling action must not interrupt the
+        # submission half-way (cf RobotActionExecutor.submit)
+        with shielded_caller():
+            if coalesce is not None:
+                return robot.executor.coalesce(coalesce, fn, args, kwargs,
+                                               partial(submit, *args, **kwargs))
+
+            return submit(*args, **kwargs)
 
     innerfunc.__name__ = fn.__name__
     innerfunc.__doc__ = fn.__doc__
     innerfunc._action = True
+    innerfunc._fn = fn
+    innerfunc._priority = priority
 
     return innerfunc
 
@@ -0,0 +1,249 @@
+# coding=utf-8
+"""
+The clock used by pyRobots' timed waits.
+
+All the timed waits of pyRobots (:meth:`.GenericRobot.sleep`, the rate
+limiting of event monitors, timeouts of :meth:`.RobotAction.result`, action
+deadlines, coroutine timers...) go through the process-wide clock returned by
+:func:`get_clock`:
+
+- :class:`WallClock` (default) follows the real time,
+- :class:`SimulatedClock` follows a virtual time, that jumps ahead as soon
+  as every pyRobots thread is blocked. It lets simulations and test
+  scenarios run much faster than real time, with the same ordering of
+  events.
+
+.. code-block:: python
+
+    from robots.concurrency.clock import SimulatedClock, set_clock
+
+    clock = SimulatedClock()
+    set_clock(clock)
+
+    with clock.participate(): # the main thread drives the scenario
+        with MyRobot() as robot:
+            robot.goto(kitchen).wait() # takes virtual time only
+
+The clock must be set before creating the robots.
+"""
+import logging; logger = logging.getLogger("robots.clock")
+
+import time
+import heapq
+import itertools
+import threading
+import thread # for get_ident
+from contextlib import contextmanager
+
+POLL_INTERVAL = 0.1 # sec: blocking waits of the main thread are polled to remain interruptible
+
+class WakeupEvent(threading._Event):
+    """ The events pyRobots' threads block on. Setting the event notifies the
+    clock (cf :meth:`SimulatedClock.notify`).
+    """
+    def set(self):
+        threading._Event.set(self)
+        _clock.notify(self)
+
+def _block(event):
+    """ Blocks until ``event`` is set.
+    """
+    if isinstance(threading.current_thread(), threading._MainThread):
+        # with Python 2, Event.wait without timeout is not interruptible
+        # (KeyboardInterrupt)
+        while not event.wait(POLL_INTERVAL):
+            pass
+    else:
+        event.wait()
+
+class WallClock(object):
+    """ The real-time clock.
+    """
+
+    def time(self):
+        return time.time()
+
+    def wait(self, event, timeout = None):
+        """ Blocks until ``event`` is set, or ``timeout`` seconds have
+        elapsed. Returns ``True`` if the event is set.
+        """
+        if timeout is not None:
+            return event.wait(timeout)
+
+        _block(event)
+        return True
+
+    def sleep(self, duration):
+        time.sleep(duration)
+
+    def notify(self, event):
+        pass
+
+    def reserve(self):
+        pass
+
+    def enter(self, reserved = False):
+        pass
+
+    def exit(self):
+        pass
+
+    @contextmanager
+    def participate(self):
+        yield
+
+
+class _ClockWaiter(object):
+    def __init__(self, event, deadline, participant):
+        self.event = event
+        self.deadline = deadline
+        self.participant = participant
+        self.blocked = True
+        self.expired = False
+
+class SimulatedClock(object):
+    """ A virtual clock, that only advances when every *participating*
+    thread is blocked in a pyRobots wait: it then jumps to the earliest
+    deadline of the pending timed waits.
+
+    The threads of the actions, of the event monitors and of the executors
+    participate automatically while they run. Other threads (typically, the
+    main thread running the scenario) must explicitly participate (cf
+    :meth:`participate`): otherwise, the clock may advance while they run.
+
+    Participating threads must only block through pyRobots' primitives
+    (:func:`.sleep`, :func:`.wait`, :meth:`.RobotAction.result`, resources,
+    ...): the clock does not advance while a participating thread is blocked
+    on anything else (a plain lock, a queue, I/O...), which is considered as
+    running.
+    """
+
+    def __init__(self, start = 0.):
+        self.now = start
+
+        self.lock = threading.Lock()
+
+        # number of participating threads not blocked on the clock, plus
+        # threads about to start (cf reserve)
+        self.running = 0
+        self.participants = set() # thread idents
+
+        self.timers = [] # heap of (deadline, seq, waiter)
+        self.seq = itertools.count()
+        self.waiters = {} # id(event) -> waiters blocked on the event
+
+    def time(self):
+        return self.now
+
+    def wait(self, event, timeout = None):
+        """ Blocks until ``event`` is set, or the virtual time has advanced
+        by ``timeout`` seconds. Returns ``True`` if the event is set.
+        """
+        with self.lock:
+            if event.is_set():
+                return True
+
+            participant = thread.get_ident() in self.participants
+            deadline = None if timeout is None else self.now + max(0, timeout)
+            waiter = _ClockWaiter(event, deadline, participant)
+            self.waiters.setdefault(id(event), []).append(waiter)
+            if deadline is not None:
+                heapq.heappush(self.timers, (deadline, next(self.seq), waiter))
+            if participant:
+                self.running -= 1
+            self._advance()
+
+        _block(event)
+
+        with self.lock:
+            self._unblock(waiter)
+            waiters = self.waiters[id(event)]
+            waiters.remove(waiter)
+            if not waiters:
+                del self.waiters[id(event)]
+            return not waiter.expired
+
+    def sleep(self, duration):
+        self.wait(threading.Event(), duration)
+
+    def notify(self, event):
+        """ Called when ``event`` is set (cf :class:`WakeupEvent`): the
+        threads blocked on it are running again.
+        """
+        with self.lock:
+            if not event.is_set():
+                # already cleared: the waiters woke up on their own, and the
+                # current ones (if any) are waiting for the next set()
+                return
+            for waiter in self.waiters.get(id(event), ()):
+                self._unblock(waiter)
+
+    def reserve(self):
+        """ Called before starting a participating thread: the clock does not
+        advance until this thread is blocked.
+        """
+        with self.lock:
+            self.running += 1
+
+    def enter(self, reserved = False):
+        """ The calling thread starts participating (cf :meth:`reserve`).
+        """
+        with self.lock:
+            self.participants.add(thread.get_ident())
+            if not reserved:
+                self.running += 1
+
+    def exit(self):
+        """ The calling thread stops participating.
+        """
+        with self.lock:
+            self.participants.discard(thread.get_ident())
+            self.running -= 1
+            self._advance()
+
+    @contextmanager
+    def participate(self):
+        """ Context manager for the calling thread to participate: the
+        clock does not advance while it runs.
+        """
+        self.enter()
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def _unblock(self, waiter):
+        if waiter.blocked:
+            waiter.blocked = False
+            if waiter.participant:
+                self.running += 1
+
+    def _advance(self):
+        """ Moves the time forward to the next deadline, if every
+        participating thread is blocked. Called with the lock held.
+        """
+        while self.running == 0 and self.timers:
+            deadline, seq, waiter = heapq.heappop(self.timers)
+            if not waiter.blocked: # woken up before its deadline
+                continue
+
+            self.now = max(self.now, deadline)
+            waiter.expired = True
+            self._unblock(waiter)
+            threading._Event.set(waiter.event) # (no notification)
+
+
+_clock = WallClock()
+
+def get_clock():
+    """ Returns the current clock.
+    """
+    return _clock
+
+def set_clock(clock):
+    """ Sets the clock used by pyRobots (eg, a :class:`SimulatedClock`),
+    and returns the previous one.
+    """
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
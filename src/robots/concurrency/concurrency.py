@@ -7,8 +7,9 @@ This module provides:
 - an implementation of :class:`SignalingThread` (threads that explicitely
   handle signals like cancelation)
 - heavily modified Python futures to support robot action management.
-- A future executor that simply spawn one thread per future (action) instead of
-  a thread pool.
+- A future executor that, by default, simply spawn one thread per future
+  (action) instead of a thread pool. A pooled mode, that reuses a bounded set
+  of pre-started worker threads, is also available.
 
 These objects should not be directly used. Users should instead rely on the
 :meth:`~robots.concurrency.action.action` decorator.
@@ -22,10 +23,12 @@ Helpful debugging commands::
 import logging; logger = logging.getLogger("robots.actions")
 
 import sys
+import time
 
 import uuid
 
-MAX_FUTURES = 20
+MAX_FUTURES = 20 # default maximum number of actions running in parallel, cf RobotActionExecutor
+MAX_ARG_LENGTH = 30 # characters: the arguments of actions are truncated to this length in the action names
 MAX_TIME_TO_COMPLETE = 1 # sec: time allowed to tasks to complete when cancelled. If they take more than that, force termination.
 ACTIVE_SLEEP_RESOLUTION = 0.1 # sec
 
@@ -40,22 +43,306 @@ import os.path #for basename
 import weakref
 import threading 
 import thread # for get_ident
+import Queue
+import heapq
+import itertools
 from collections import deque
 
 import traceback
+import ctypes
+try:
+    import resource # for the default stack size (Unix only)
+except ImportError:
+    resource = None
+from functools import partial
+from contextlib import contextmanager
 
-from .signals import ActionCancelled, ActionPaused
+from .signals import ActionCancelled, ActionPaused, ActionRejected
+from .clock import WakeupEvent, get_clock
 
+# paused threads never park (cf SignalingThread.pause) while executing code of
+# these modules, as they may hold locks shared with other threads
+_NO_PARK_MODULES = ("threading", "Queue", "logging", "concurrent.futures",
+                    "robots.concurrency", "robots.resources")
 
 class SignalingThread(threading.Thread):
+    """ A thread that can be asynchronously signaled: :meth:`cancel` raises
+    :class:`.ActionCancelled` within the thread, and :meth:`pause` suspends
+    the thread until :meth:`resume` is called.
+
+    How the signals are delivered depends on the thread's cancellation
+    ``backend``:
+
+    - :attr:`TRACE` (default): a ``sys.settrace`` hook checks for pending
+      signals on every line of Python code executed by the thread while it
+      executes its action. Signals are delivered almost immediately,
+      anywhere (except in the ``threading`` module), but the hook slows down
+      Python code significantly (in particular CPU-bound code).
+    - :attr:`ASYNC`: signals are injected as asynchronous exceptions
+      (``PyThreadState_SetAsyncExc``) while the thread executes its action.
+      No overhead when no signal is sent, but the exception may be raised at
+      any bytecode, including within the ``threading`` module.
+    - :attr:`COOPERATIVE`: signals are only raised at *checkpoints*
+      (:func:`checkpoint`), ie, in :meth:`.GenericRobot.sleep`, while waiting
+      for resources or for the result of other actions. No overhead, but
+      long computations without checkpoints can not be interrupted.
+
+    With every backend, a thread blocked in :func:`wait` or :func:`sleep`
+    is woken up as soon as it is signaled.
+
+    A paused thread *parks*: it blocks on a condition (without spinning),
+    keeping its state (including the locked resources) until it is resumed
+    or cancelled. With the TRACE backend, the thread parks on the next line
+    of code executed outside of pyRobots' and Python's synchronization
+    modules (they may hold locks); with the other backends, it parks at the
+    next checkpoint.
+    """
+
+    TRACE = "trace"
+    ASYNC = "async"
+    COOPERATIVE = "cooperative"
+
     def __init__(self, *args, **kwargs):
+        self.backend = kwargs.pop("backend", SignalingThread.TRACE)
+        self.status = None # cf set_status
         threading.Thread.__init__(self, *args, **kwargs)
         self.debugger_trace = None
 
+        self.__cancel = False
+        self.__pause = False # pending request to park, cf pause()
+
+        # suspension state: whether the thread should be suspended, and
+        # whether it is actually parked. Protected by pause_cond.
+        self.__suspended = False
+        self.parked = False
+        self.pause_cond = threading.Condition()
+        self.pause_time = None # time of the last call to pause()
+        self.resume_time = None # time of the last call to resume()
+
+        # with the TRACE and ASYNC backends, signals are only raised
+        # asynchronously while the thread is 'interruptible' (cf
+        # interruptible()). Protected by signal_lock.
+        self.__interruptible = False
+        self.__injected = False # True while an injected signal has not been caught yet
+        self.signal_lock = threading.Lock()
+
+        # set whenever the thread is signaled, to wake it up if it is
+        # blocked in wait()
+        self.wakeup = WakeupEvent()
+
+    @property
+    def name(self):
+        if self.status is None:
+            return threading.Thread.name.fget(self)
+        return self.status[0] % self.status[1:]
+
+    @name.setter
+    def name(self, name):
+        self.status = None
+        threading.Thread.name.fset(self, name)
+
+    def set_status(self, fmt, *args):
+        """ Sets the name of the thread to ``fmt % args``. The name is only
+        formatted when it is actually read (for instance, when logging).
+        """
+        self.status = (fmt,) + args
+
     def cancel(self):
-        self.__cancel = True
+        self.__signal(ActionCancelled)
+
+    @property
+    def cancel_pending(self):
+        """ ``True`` if the thread has been cancelled, but the signal has not
+        been raised yet (for instance, because the thread is shielded).
+        """
+        return self.__cancel
+
     def pause(self):
-        self.__pause = True
+        """ Requests the thread to suspend itself (cf class documentation).
+        Does not wait for the thread to be actually parked (cf
+        :meth:`wait_parked`).
+        """
+        with self.pause_cond:
+            if self.__suspended:
+                return
+            self.__suspended = True
+            self.__pause = True
+            self.pause_time = time.time()
+        self.wakeup.set()
+
+    def resume(self):
+        """ Resumes the thread suspended by :meth:`pause`.
+        """
+        with self.pause_cond:
+            if not self.__suspended:
+                return
+            self.__suspended = False
+            self.__pause = False
+            self.resume_time = time.time()
+            self.pause_cond.notify_all()
+        self.wakeup.set() # wakes up the parked thread
+
+    def wait_parked(self, timeout = None):
+        """ Blocks until the thread is parked, or is not suspended anymore
+        (resumed, or signals reset). Returns ``True`` if the thread is
+        parked.
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self.pause_cond:
+            while self.__suspended and not self.parked:
+                if end is None:
+                    self.pause_cond.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        break
+                    self.pause_cond.wait(remaining)
+            return self.parked
+
+    def reset_signals(self):
+        with self.pause_cond:
+            self.__cancel = False
+            self.__pause = False
+            self.__suspended = False
+            self.pause_cond.notify_all()
+
+    def __signal(self, signal):
+        with self.signal_lock:
+            if self.backend == SignalingThread.ASYNC and self.__interruptible:
+                self.__injected = True
+                _async_raise(self.ident, _INJECTED_SIGNALS[signal])
+            else:
+                self.__cancel = True
+        self.wakeup.set()
+
+    def checkpoint(self):
+        """ Raises the pending signal, if any, or parks the thread if it has
+        been paused. Must be called from the thread itself.
+        """
+        if self.__pause:
+            self.__park()
+        if self.__cancel:
+            self.__cancel = False
+            logger.debug("Cancelling thread <%s> at checkpoint", self.name)
+            raise ActionCancelled()
+
+    def __park(self):
+        """ Blocks the thread until it is resumed or cancelled. Must be
+        called from the thread itself.
+        """
+        with self.shielded():
+            with self.pause_cond:
+                self.__pause = False
+                if not self.__suspended or self.__cancel:
+                    return
+                self.parked = True
+                self.pause_cond.notify_all() # cf wait_parked
+                pause_latency = time.time() - self.pause_time
+
+                status = self.status
+                name = threading.Thread.name.fget(self)
+                logger.debug("Pausing thread <%s>", self.name)
+                self.set_status("%s (paused)", self.name)
+
+            # the thread is woken up by resume() and cancel(), through the
+            # wakeup event (the clock knows the thread is blocked)
+            clock = get_clock()
+            while True:
+                with self.pause_cond:
+                    if not self.__suspended or self.__cancel:
+                        self.parked = False
+                        if status is None:
+                            self.name = name
+                        else:
+                            self.status = status
+                        resume_latency = None if self.__suspended else time.time() - self.resume_time
+                        break
+                    self.wakeup.clear()
+                clock.wait(self.wakeup)
+
+            logger.debug("Thread <%s> resumed", self.name)
+            self.pause_completed(pause_latency, resume_latency)
+
+    def pause_completed(self, pause_latency, resume_latency):
+        """ Called by the thread when it resumes after having been paused,
+        with the time (in seconds) it took to park after :meth:`pause`, and
+        to restart after :meth:`resume` (``None`` if the thread has been
+        cancelled instead). Does nothing by default.
+        """
+        pass
+
+    def signal_delivered(self):
+        """ Called when a signal injected by the ASYNC backend is caught.
+        """
+        self.__injected = False
+
+    def __set_interruptible(self, interruptible):
+        """ Enables or disables the injection of signals (ASYNC backend), and
+        returns the previous state. Must be called from the thread itself.
+        """
+        while True:
+            if not interruptible and self.__injected:
+                # the interpreter only raises asynchronous exceptions every
+                # sys.getcheckinterval() bytecodes: give a signal already
+                # injected the opportunity to be raised *here*, before
+                # disabling injections. If it is not raised by then, it has
+                # been raised before, and is still propagating.
+                for i in range(10 * sys.getcheckinterval()):
+                    if not self.__injected:
+                        break
+                self.__injected = False
+
+            with self.signal_lock:
+                if interruptible or not self.__injected:
+                    previous = self.__interruptible
+                    self.__interruptible = interruptible
+                    return previous
+
+    @contextmanager
+    def interruptible(self):
+        """ Context manager delimiting the section of code where signals can
+        be asynchronously raised (TRACE and ASYNC backends). Must be used
+        from the thread itself.
+
+        Signals received before entering the section are raised when
+        entering it.
+        """
+        if self.backend == SignalingThread.COOPERATIVE:
+            self.checkpoint()
+            yield
+            return
+
+        self.__set_interruptible(True)
+        try:
+            self.checkpoint()
+            yield
+        finally:
+            self.__set_interruptible(False)
+
+    @contextmanager
+    def shielded(self):
+        """ Context manager delimiting a section of code where signals are
+        *not* asynchronously raised, but only recorded, to be raised at the
+        next :meth:`checkpoint` (TRACE and ASYNC backends).
+
+        Used to protect blocking waits: an exception raised in the middle of
+        ``threading.Condition.wait`` could leave the condition in an
+        inconsistent state.
+        """
+        if self.backend == SignalingThread.COOPERATIVE:
+            yield
+            return
+
+        previous = self.__set_interruptible(False)
+        try:
+            yield
+        finally:
+            if previous:
+                self.__set_interruptible(True)
+
+    def run(self):
+        with self.interruptible():
+            threading.Thread.run(self)
 
     def _Thread__bootstrap(self):
         """ The name come from Python name mangling for 
@@ -69,15 +356,16 @@ class SignalingThread(threading.Thread):
         else:
             self.debugger_trace = None
 
-        self.__cancel = False
-        self.__pause = False
-        sys.settrace(self.__signal_emitter)
+        if self.backend == SignalingThread.TRACE:
+            sys.settrace(self.__signal_emitter)
 
         self.name = "Ranger action thread (initialization)"
         super(SignalingThread, self)._Thread__bootstrap()
 
     def __signal_emitter(self, frame, event, arg):
-        if self.__cancel:
+        if not self.__interruptible:
+            pass
+        elif self.__cancel:
             if frame.f_globals["__name__"] == "threading":
                 # Raising exception at uncontrolled time is a dangerous sport,
                 # especially if the thread is in the middle of locking/unlocking shared resources
@@ -98,22 +386,570 @@ class SignalingThread(threading.Thread):
 
                 logger.debug(desc)
                 raise ActionCancelled()
-        if self.__pause:
-            self.__pause = False
-            logger.debug("Pausing thread <%s>" % self.name)
-            raise ActionPaused()
+        elif self.__pause:
+            if not frame.f_globals.get("__name__", "").startswith(_NO_PARK_MODULES):
+                self.__park()
 
         if self.debugger_trace:
             return self.debugger_trace
         else:
             return self.__signal_emitter
 
-class RobotActionThread(SignalingThread):
-    def __init__(self, future, initialized, fn, args, kwargs):
-        SignalingThread.__init__(self)
+class _InjectedSignal(object):
+    """ Mixin for the signals injected by the ASYNC backend: the exception is
+    instantiated when it is caught, which acknowledges its delivery to the
+    thread.
+    """
+    def __init__(self, *args):
+        super(_InjectedSignal, self).__init__(*args)
+        thread = threading.current_thread()
+        if isinstance(thread, SignalingThread):
+            thread.signal_delivered()
 
-        initialized.set()
+class _InjectedActionCancelled(_InjectedSignal, ActionCancelled): pass
 
+_INJECTED_SIGNALS = {ActionCancelled: _InjectedActionCancelled}
+
+def _async_raise(ident, signal):
+    """ Asynchronously raises the exception class ``signal`` in the thread
+    ``ident``.
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(ident),
+                                               ctypes.py_object(signal))
+
+# threading.stack_size is process-wide: serializes the creation of threads
+# with a custom stack size (cf start_thread)
+_stack_size_lock = threading.Lock()
+
+def start_thread(thread, stack_size = None):
+    """ Starts ``thread`` with a stack of ``stack_size`` bytes (the default
+    stack size if ``None``).
+
+    Threads started concurrently *without* this function may also get the
+    custom stack size.
+    """
+    if not stack_size:
+        thread.start()
+        return
+
+    with _stack_size_lock:
+        previous = threading.stack_size(stack_size)
+        try:
+            thread.start()
+        finally:
+            threading.stack_size(previous)
+
+def default_stack_size():
+    """ Returns the default stack size of the threads (in bytes), or ``None``
+    if unknown.
+    """
+    size = threading.stack_size()
+    if size:
+        return size
+
+    # by default, the threads of glibc reserve the stack size limit of the
+    # process (ulimit -s)
+    if resource is None:
+        return None
+    size = resource.getrlimit(resource.RLIMIT_STACK)[0]
+    if size <= 0 or size == resource.RLIM_INFINITY:
+        return None
+    return size
+
+def process_memory():
+    """ Returns the virtual and resident memory of the process (in bytes) as a
+    dictionary ``{"virtual": ..., "resident": ...}``, or ``None`` if not
+    available (only implemented for Linux).
+    """
+    try:
+        with open("/proc/self/status") as status:
+            fields = dict(line.split(":", 1) for line in status if ":" in line)
+        return {"virtual": int(fields["VmSize"].split()[0]) * 1024,
+                "resident": int(fields["VmRSS"].split()[0]) * 1024}
+    except (IOError, KeyError, ValueError):
+        return None
+
+@contextmanager
+def shielded_caller():
+    """ Shields the calling thread from signals if it is a
+    :class:`SignalingThread` (cf :meth:`SignalingThread.shielded`): the
+    signals are raised at the next checkpoint.
+
+    Used around the submission of sub-actions: a cancellation raised
+    between the registration of an action and the start of its thread would
+    leave a pending action that nobody will ever run.
+    """
+    thread = threading.current_thread()
+    if isinstance(thread, SignalingThread):
+        with thread.shielded():
+            yield
+    else:
+        yield
+
+def set_thread_status(fmt, *args):
+    """ Lazily sets the name of the calling thread, if it is a
+    :class:`SignalingThread` (cf :meth:`SignalingThread.set_status`).
+    """
+    thread = threading.current_thread()
+    if isinstance(thread, SignalingThread):
+        thread.set_status(fmt, *args)
+
+def _short_str(value):
+    """ Returns a cheap, truncated, string representation of ``value``, used
+    in the names of actions.
+    """
+    shape = getattr(value, "shape", None)
+    if shape is not None and hasattr(value, "dtype"):
+        # do not format the content of (possibly large) arrays
+        return "<%s %s>" % (type(value).__name__, "x".join([str(d) for d in shape]))
+
+    s = str(value)
+    if len(s) > MAX_ARG_LENGTH:
+        s = s[:MAX_ARG_LENGTH - 3] + "..."
+    return s
+
+def checkpoint():
+    """ Raises the pending signal (:class:`.ActionCancelled`) of the calling
+    thread, if any, or parks it if it has been paused (cf
+    :meth:`SignalingThread.pause`).
+
+    Long-running actions should call it regularly to remain cancellable
+    with the COOPERATIVE cancellation backend (cf :class:`SignalingThread`).
+    """
+    thread = threading.current_thread()
+    if isinstance(thread, SignalingThread):
+        thread.checkpoint()
+
+def sleep(duration):
+    """ Sleeps for ``duration`` seconds.
+
+    When called from a :class:`SignalingThread` (ie, from an action), the
+    sleep is interrupted as soon as the thread is signaled, and the signal
+    is raised.
+    """
+    thread = threading.current_thread()
+    clock = get_clock()
+
+    if not isinstance(thread, SignalingThread):
+        clock.sleep(duration)
+        return
+
+    wakeup = thread.wakeup
+
+    end = clock.time() + duration
+    with thread.shielded():
+        while True:
+            wakeup.clear()
+            thread.checkpoint()
+            remaining = end - clock.time()
+            if remaining <= 0:
+                return
+            clock.wait(wakeup, remaining)
+
+_waiters_lock = threading.Lock()
+
+class _CompletionWaiters(object):
+    """ The callbacks waiting for the completion of a future (cf
+    :func:`_add_waiter`). Installed as a single done callback of the future.
+    """
+    def __init__(self):
+        self.callbacks = []
+        self.notified = False
+
+    def __call__(self, future):
+        with _waiters_lock:
+            self.notified = True
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(future)
+            except Exception:
+                logger.exception("Exception calling a waiter of %r", future)
+
+def _add_waiter(future, callback):
+    """ Calls ``callback(future)`` once ``future`` is done (immediately if
+    it is already done).
+
+    Unlike ``add_done_callback``, the callback can be unregistered (cf
+    :func:`_remove_waiter`): the future only holds one done callback,
+    whatever the number of waits on it, so that waiting repeatedly (with a
+    timeout) on a long-running action does not accumulate callbacks.
+    """
+    install = notified = False
+    with _waiters_lock:
+        waiters = getattr(future, "_completion_waiters", None)
+        if waiters is None:
+            waiters = future._completion_waiters = _CompletionWaiters()
+            install = True
+        if waiters.notified:
+            notified = True
+        else:
+            waiters.callbacks.append(callback)
+
+    if install:
+        future.add_done_callback(waiters) # called immediately if already done
+    elif notified:
+        callback(future)
+
+def _remove_waiter(future, callback):
+    """ Unregisters a callback added by :func:`_add_waiter`, if it has not
+    been called yet.
+    """
+    with _waiters_lock:
+        waiters = getattr(future, "_completion_waiters", None)
+        if waiters is not None and callback in waiters.callbacks:
+            waiters.callbacks.remove(callback)
+
+def wait(future, timeout = None):
+    """ Blocks until the given future is done, or ``timeout`` (in seconds)
+    has elapsed. Returns ``True`` if the future is done.
+
+    When called from a :class:`SignalingThread` (ie, from an action), this
+    does not poll: the thread sleeps until either the future completes, or
+    the thread itself is signaled (cancelled or paused). In the later case,
+    the signal is raised as soon as the wait returns.
+    """
+    if future.done():
+        return True
+
+    thread = threading.current_thread()
+    clock = get_clock()
+
+    if not isinstance(thread, SignalingThread):
+        # can not be signaled: simply wait for the future
+        done = WakeupEvent()
+        on_done = lambda f: done.set()
+        _add_waiter(future, on_done)
+        try:
+            clock.wait(done, timeout)
+        finally:
+            _remove_waiter(future, on_done)
+        return future.done()
+
+    wakeup = thread.wakeup
+    on_done = lambda f: wakeup.set()
+    _add_waiter(future, on_done)
+
+    end = None if timeout is None else clock.time() + timeout
+    try:
+        with thread.shielded():
+            while True:
+                # clear *before* checking the future, so that a completion happening
+                # in-between is not missed
+                wakeup.clear()
+                thread.checkpoint()
+                if future.done():
+                    return True
+
+                if end is None:
+                    clock.wait(wakeup)
+                else:
+                    remaining = end - clock.time()
+                    if remaining <= 0:
+                        return False
+                    clock.wait(wakeup, remaining)
+    finally:
+        # timeout or cancellation: the future must not keep a callback per
+        # wait (cf _add_waiter)
+        _remove_waiter(future, on_done)
+
+class _Completions(object):
+    """ Waiter (cf :func:`_add_waiter`) of the futures awaited by
+    :func:`as_completed`: queues them and wakes up the waiting thread, until
+    closed.
+    """
+    def __init__(self, wakeup):
+        self.lock = threading.Lock()
+        self.completed = deque()
+        self.wakeup = wakeup
+
+    def __call__(self, future):
+        with self.lock:
+            if self.wakeup is None: # closed
+                return
+            self.completed.append(future)
+            self.wakeup.set()
+
+    def close(self):
+        # a notification may already be on its way when the waiter is
+        # unregistered: it must not reach the thread anymore
+        with self.lock:
+            self.wakeup = None
+            self.completed.clear()
+
+def as_completed(futures, timeout = None):
+    """ Iterates over the given futures (typically, actions) as they
+    complete. Raises :class:`concurrent.futures.TimeoutError` if some of them
+    are still running after ``timeout`` seconds.
+
+    The calling thread is only woken up by the completion of the futures
+    (one notification per future, no polling). When called from a
+    :class:`SignalingThread` (ie, from an action), the wait is interrupted
+    as soon as the thread is signaled, and the signal is raised (cf
+    :func:`wait`).
+    """
+    thread = threading.current_thread()
+    signaling = isinstance(thread, SignalingThread)
+    wakeup = thread.wakeup if signaling else WakeupEvent()
+    clock = get_clock()
+
+    on_done = _Completions(wakeup)
+    completed = on_done.completed
+    registered = []
+
+    try:
+        nb_pending = 0
+        seen = set()
+        for f in futures:
+            if id(f) in seen:
+                continue
+            seen.add(id(f))
+            nb_pending += 1
+            if hasattr(f, "add_done_callback"):
+                registered.append(f)
+                _add_waiter(f, on_done) # called immediately if already done
+            else: # FakeFuture, used in 'immediate' mode
+                completed.append(f)
+
+        end = None if timeout is None else clock.time() + timeout
+
+        while nb_pending:
+            # clear *before* checking, so that a completion happening in-between
+            # is not missed
+            wakeup.clear()
+
+            while completed:
+                nb_pending -= 1
+                yield completed.popleft()
+            if not nb_pending:
+                return
+
+            if end is not None and end - clock.time() <= 0:
+                raise TimeoutError()
+
+            if signaling:
+                with thread.shielded():
+                    thread.checkpoint()
+                    clock.wait(wakeup, None if end is None else end - clock.time())
+            else:
+                clock.wait(wakeup, None if end is None else end - clock.time())
+    finally:
+        # timeout, early exit of the caller (break, wait_any...): the
+        # futures still running must not wake up this thread anymore
+        for f in registered:
+            _remove_waiter(f, on_done)
+        on_done.close()
+
+def wait_all(futures, timeout = None):
+    """ Blocks until all the given futures are done, or ``timeout`` seconds
+    have elapsed. Returns ``True`` if they are all done.
+
+    Cf :func:`as_completed` for the behaviour within actions.
+    """
+    try:
+        for f in as_completed(futures, timeout):
+            pass
+        return True
+    except TimeoutError:
+        return False
+
+def wait_any(futures, timeout = None):
+    """ Blocks until one of the given futures is done, or ``timeout`` seconds
+    have elapsed. Returns the first future to complete, or ``None`` after
+    ``timeout``.
+
+    Cf :func:`as_completed` for the behaviour within actions.
+    """
+    completions = as_completed(futures, timeout)
+    try:
+        for f in completions:
+            return f
+    except TimeoutError:
+        return None
+    finally:
+        completions.close()
+
+class LatencyHistogram(object):
+    """ Histogram of durations, with logarithmic buckets: bucket ``i``
+    counts the durations between 2^(i-1) and 2^i microseconds (bucket 0
+    holds the durations below 1us).
+    """
+
+    NB_BUCKETS = 40 # up to ~6 days
+
+    def __init__(self):
+        self.buckets = [0] * LatencyHistogram.NB_BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.min = float("inf")
+        self.max = 0.
+
+    def add(self, duration):
+        """ Records a duration, in seconds.
+        """
+        # (bit_length of the duration in microseconds, ie, the bucket index)
+        self.buckets[min(int(duration * 1e6).bit_length(), self.NB_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if duration < self.min:
+            self.min = duration
+
+    def percentile(self, p):
+        """ Returns an upper bound of the ``p``-th percentile (``p`` between
+        0 and 100) of the recorded durations, in seconds.
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100.
+        seen = 0
+        for i, nb in enumerate(self.buckets):
+            seen += nb
+            if nb and seen >= rank:
+                return min(2 ** i * 1e-6, self.max)
+        return self.max
+
+    def to_dict(self):
+        """ Returns the summary of the histogram as a dictionary with keys
+        ``count``, ``mean``, ``min``, ``max``, ``p50``, ``p90``, ``p99``
+        (in seconds), and ``buckets``: ``{<bucket upper bound, in sec>:
+        <count>}`` for the non-empty buckets.
+        """
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "min": self.min if self.count else None,
+                "max": self.max,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "buckets": dict((2 ** i * 1e-6, nb) for i, nb in enumerate(self.buckets) if nb)}
+
+class ProgressQueue(object):
+    """ The bounded queue of the values yielded by a generator action (cf
+    the ``progress_*`` options of :func:`~robots.concurrency.action.action`
+    and :meth:`RobotAction.progress`).
+
+    When the queue is full, the ``policy`` decides what the action does:
+
+    - :attr:`DROP_OLDEST`: the oldest value is discarded (the action never
+      waits for its consumers),
+    - :attr:`BLOCK`: the action waits until a consumer reads a value.
+
+    Both the action (with :attr:`BLOCK`) and the consumers remain
+    cancellable while waiting.
+    """
+
+    DROP_OLDEST = "drop oldest"
+    BLOCK = "block"
+
+    def __init__(self, maxsize, policy = DROP_OLDEST):
+        self.maxsize = maxsize
+        self.policy = policy
+
+        self.lock = threading.Lock()
+        self.items = deque()
+        self.closed = False
+        self.dropped = 0 # number of values discarded (DROP_OLDEST)
+
+        # events of the threads waiting for a value/for room in the queue
+        self.getters = []
+        self.putters = []
+
+    def put(self, value):
+        event = None
+        while True:
+            with self.lock:
+                if len(self.items) < self.maxsize or self.policy == ProgressQueue.DROP_OLDEST:
+                    if len(self.items) >= self.maxsize:
+                        self.items.popleft()
+                        self.dropped += 1
+                    self.items.append(value)
+                    self.getters = self._wake(self.getters)
+                    return
+                if event is not None:
+                    self.putters.append(event)
+
+            if event is None:
+                # the queue is full: get an event, and check again
+                event = self._event()
+            else:
+                self._block(event)
+                event = None
+
+    def close(self):
+        """ Called on completion of the action: the consumers stop iterating
+        once the remaining values have been read.
+        """
+        with self.lock:
+            self.closed = True
+            self.getters = self._wake(self.getters)
+
+    def __iter__(self):
+        event = None
+        while True:
+            read = False
+            with self.lock:
+                if self.items:
+                    value = self.items.popleft()
+                    read = True
+                    self.putters = self._wake(self.putters)
+                elif self.closed:
+                    return
+                elif event is not None:
+                    self.getters.append(event)
+
+            if read:
+                yield value
+            elif event is None:
+                # the queue is empty: get an event, and check again
+                event = self._event()
+            else:
+                self._block(event)
+                event = None
+
+    def _event(self):
+        """ Returns a (cleared) event to wait on: the wakeup event of action
+        threads, so that they remain cancellable.
+        """
+        thread = threading.current_thread()
+        event = thread.wakeup if isinstance(thread, SignalingThread) else WakeupEvent()
+        event.clear()
+        return event
+
+    def _wake(self, events):
+        for event in events:
+            event.set()
+        return []
+
+    def _block(self, event):
+        thread = threading.current_thread()
+        if isinstance(thread, SignalingThread):
+            with thread.shielded():
+                thread.checkpoint()
+                get_clock().wait(event)
+        else:
+            get_clock().wait(event)
+
+def stream_progress(future, generator):
+    """ Runs the generator of a generator action, pushing the yielded values
+    to the progress queue of ``future``. Returns the value passed to
+    ``StopIteration``, if any.
+    """
+    queue = future.progress_queue
+    while True:
+        checkpoint()
+        try:
+            value = next(generator)
+        except StopIteration as e:
+            return e.args[0] if e.args else None
+        queue.put(value)
+
+class RobotActionThread(SignalingThread):
+    def __init__(self, executor, future, fn, args, kwargs):
+        SignalingThread.__init__(self, backend = executor.cancellation)
+
+        self.executor = executor
         self.future = future
         self.fn = fn
         self.args = args
@@ -121,90 +957,417 @@ class RobotActionThread(SignalingThread):
 
     def run(self):
 
-        if not self.future.set_running_or_notify_cancel():
-            return
+        clock = get_clock()
+        clock.enter(reserved = True) # cf RobotActionExecutor.submit
+        try:
+            if not self.future.set_running_or_notify_cancel():
+                return
+
+            self.execute(self.future, self.fn, self.args, self.kwargs)
+            self.reset_signals() # wakes up the callers of wait_parked, if any
+        finally:
+            clock.exit()
+
+    def pause_completed(self, pause_latency, resume_latency):
+        self.executor.record_pause(pause_latency, resume_latency)
+
+    def execute(self, future, fn, args, kwargs):
+
+        # index the action by its thread, for fast lookup by
+        # RobotActionExecutor.get_current_action
+        actions_by_thread = self.executor.actions_by_thread
+        ident = self.ident
+        actions_by_thread[ident] = future
+
+        future.start_time = time.time()
 
         try:
-            result = self.fn(self.future, str(self.future),*self.args, **self.kwargs)
-            self.future.set_result(result)
-            logger.debug("Action <%s>: completed." % str(self.future))
+            with self.interruptible():
+                result = fn(future, *args, **kwargs)
+            actions_by_thread.pop(ident, None)
+            future.set_result(result)
+            logger.debug("Action <%s>: completed.", future)
         except BaseException:
+            actions_by_thread.pop(ident, None)
             e = sys.exc_info()[1]
-            logger.error("Exception in action <%s>: %s"%(str(self.future), e)) #self.fn.__name__
+            logger.error("Exception in action <%s>: %s", future, e) #fn.__name__
             logger.error(traceback.format_exc())
-            self.future.set_exception(e)
+            future.set_exception(e)
+
+class RobotActionWorker(RobotActionThread):
+    """ A long-lived action thread, used by pooled :class:`RobotActionExecutor`.
+
+    Workers are started once, and then repeatedly pick up actions from the
+    executor's queue of jobs. Signals (cancellation, pause) are only forwarded
+    to the worker while it is actually executing an action: an idle worker can
+    not be cancelled.
+    """
+    def __init__(self, executor, jobs):
+        SignalingThread.__init__(self, backend = executor.cancellation)
+        self.daemon = True
+
+        self.executor = executor
+        self.jobs = jobs
+
+        self.future = None
+        self.job_lock = threading.Lock()
+
+    def cancel(self):
+        with self.job_lock:
+            if self.future is not None and not self.future.done():
+                SignalingThread.cancel(self)
+
+    def pause(self):
+        with self.job_lock:
+            if self.future is not None and not self.future.done():
+                SignalingThread.pause(self)
+
+    def idle(self):
+        return self.future is None
+
+    def run(self):
+
+        self.name = "Idle Robot action thread"
+
+        executor = self.executor
+
+        while True:
+            priority, seq, job = self.jobs.get()
+
+            clock = get_clock()
+            with executor.pool_lock:
+                executor.idle_workers -= 1
+                reserved = executor.clock_reservations > 0
+                if reserved:
+                    executor.clock_reservations -= 1
+
+            if job is None: # executor shutting down
+                if reserved:
+                    clock.enter(reserved = True)
+                    clock.exit()
+                return
+
+            future, fn, args, kwargs = job
+
+            # the thread must be known to the future *before* it starts
+            # running, so that it can always be cancelled (cf RobotAction.cancel)
+            with self.job_lock:
+                self.future = future
+                future.set_thread(weakref.ref(self))
+
+            clock.enter(reserved = reserved) # cf RobotActionExecutor.submit
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        self.execute(future, fn, args, kwargs)
+                    except (ActionCancelled, ActionPaused):
+                        # signal received after the action completed, but before
+                        # the worker went back to idle: nothing left to interrupt.
+                        pass
+
+                with self.job_lock:
+                    self.future = None
+                    self.reset_signals()
+            finally:
+                # back to idle: if jobs are queued, the clock is reserved
+                # *before* leaving it, so that it does not advance until one
+                # of them is picked up
+                with executor.pool_lock:
+                    executor.idle_workers += 1
+                    executor.reserve_workers()
+                clock.exit()
 
 
 class RobotAction(Future):
-    def __init__(self, actionname):
+    def __init__(self, name, args = (), kwargs = None):
         Future.__init__(self)
 
-        self.actionname = actionname
+        # the full name of the action (with its arguments) is only computed
+        # when needed, cf actionname
+        self._name = (name, args, kwargs or {})
+        self._actionname = None
 
         self.thread = None
         self.id = uuid.uuid4()
 
-        self.subactions = []
+        # the tree of actions: live children of the action (id(child) ->
+        # child, children are unlinked on completion), weakref to the parent,
+        # and ids (uuids) of all the ancestors.
+        self.children = {}
         self.parent_action = None
+        self.ancestors = frozenset()
 
         self.has_acquired_resource = False
 
+        # whether the action has been admitted by the executor's admission
+        # control (cf RobotActionExecutor), and whether it has been started
+        # from the admission queue but is not running yet
+        self.admitted = False
+        self.starting = False
+
+        # cf the 'priority' option of @action
+        self.priority = 0
+
+        # the executor managing the action
+        self.executor = None
+
+        # absolute time (time.time()) after which the action is cancelled,
+        # cf set_timeout
+        self.deadline = None
+        self.timed_out = False
+
+        # values yielded by generator actions, cf progress()
+        self.progress_queue = None
+
+        # lifecycle timestamps (time.time()): submission, beginning of the
+        # execution by its thread (before waiting for resources), beginning
+        # of the action body (resources acquired), first cancellation request,
+        # completion. Cf RobotActionExecutor.lifecycle_stats
+        self.submit_time = time.time()
+        self.start_time = None
+        self.run_time = None
+        self.cancel_time = None
+        self.end_time = None
+
+    @property
+    def actionname(self):
+        """ The name of the action, with its (truncated) arguments.
+        Computed on first access.
+        """
+        if self._actionname is None:
+            name, args, kwargs = self._name
+            params = [_short_str(a) for a in args]
+            params += ["%s=%s" % (k, _short_str(v)) for k, v in kwargs.items()]
+            self._actionname = "%s(%s)" % (name, ", ".join(params))
+        return self._actionname
+
+    def progress(self):
+        """ Iterates over the values yielded by a generator action, as they
+        are produced, until the action completes.
+
+        .. code-block:: python
+
+            for distance in robot.goto(kitchen).progress():
+                print("%.1fm to go" % distance)
+        """
+        if self.progress_queue is None:
+            raise RuntimeError("Action %s does not report progress (it is not a generator function)" % self)
+        return iter(self.progress_queue)
+
+    def startup_latency(self):
+        """ Returns the time (in seconds) elapsed between the submission of
+        the action and the beginning of its execution, or ``None`` if the
+        action has not started yet.
+        """
+        if self.start_time is None:
+            return None
+        return self.start_time - self.submit_time
+
+    @property
+    def subactions(self):
+        """ The list of the live (ie, not done) children of the action.
+        """
+        return self.children.values()
+
     def add_subaction(self, action):
-        self.subactions = [a for a in self.subactions if a() is not None and a().thread() is not None]
-        self.subactions.append(action)
-        logger.debug("Added sub-action %s to action %s" % (str(action()), str(self)))#.actionname))  1: action().actionname
+        """ Adds a child to the action. The child is automatically unlinked
+        when it completes.
+        """
+        self.children[id(action)] = action
+
+        parent = weakref.ref(self)
+        def unlink(child):
+            myself = parent()
+            if myself is not None:
+                myself.children.pop(id(child), None)
+        action.add_done_callback(unlink)
+
+        logger.debug("Added sub-action %s to action %s", action, self)
 
     def set_parent(self, action):
-        self.parent_action = action
+        self.parent_action = weakref.ref(action)
+        self.ancestors = action.ancestors | frozenset([action.id])
 
     def childof(self, action):
         """ Returns true if this action is a child of the given action, ie, has
         been spawned from the given action or any of its descendants.
         """
-        parent = self.parent_action() # weakref!
-        if parent is None:
-            return False
-        if parent is action:
-            return True
-        return parent.childof(action)
+        return action.id in self.ancestors
+
+    def descendants(self):
+        """ Iterates (depth-first) over the live descendants of the action,
+        as ``(depth, action)`` tuples (the children of the action have
+        depth 1).
+        """
+        stack = [(1, child) for child in self.children.values()]
+        while stack:
+            depth, action = stack.pop()
+            yield depth, action
+            stack.extend([(depth + 1, child) for child in action.children.values()])
+
+    def tree(self):
+        """ Returns the tree of the live sub-actions of the action, as
+        nested dictionaries ``{"action": <action>, "children": [<subtrees>]}``.
+        """
+        return {"action": self,
+                "children": [child.tree() for child in self.children.values()]}
 
     def set_thread(self, thread):
         self.thread = thread
 
-    def cancel(self):
-        # we do not call the 'standard' Future.cancel method since we do not have a thread pool (ie,
-        # the future can not be 'pending for execution'), which is the only useful usecase (well, with callback on
-        # cancellation, I imagine... so those are not supported for now)
+    def set_timeout(self, timeout):
+        """ Cancels the action (and its sub-actions) if it is still running
+        ``timeout`` seconds from now. Overrides the timeout set with
+        ``@action(timeout=...)``, if any. ``None`` removes the deadline.
+
+        When the deadline passes, :attr:`timed_out` is set to ``True``, and
+        the action receives :class:`.ActionCancelled`.
+        """
+        if timeout is None:
+            self.deadline = None
+            return
+
+        self.deadline = get_clock().time() + timeout
+        self.executor.add_deadline(self, self.deadline)
+
+    def interrupt(self):
+        """ Sends the cancellation signal to the action (and only to this
+        action, not to its sub-actions), without waiting for the action to
+        complete.
+
+        Returns ``False`` if the action is not running: already done, or
+        still pending for execution (in which case it is simply removed
+        from the queue).
+        """
+
+        # we only call the 'standard' Future.cancel method if the action is
+        # still pending for execution (ie, queued in a pooled executor). Otherwise, we
+        # signal the action's thread.
+
+        if self.thread is None:
+            if Future.cancel(self):
+                logger.debug("Action <%s>: cancelled before starting", self)
+            else:
+                logger.debug("Action <%s>: already done", self)
+            return False
 
         thread = self.thread() # weakref!
         if thread is None:
-            logger.debug("Action <%s>: already done" % self)
-            return
+            # the thread is gone: either the action is done, or its thread
+            # never started
+            if Future.cancel(self):
+                logger.debug("Action <%s>: cancelled before starting", self)
+            else:
+                logger.debug("Action <%s>: already done", self)
+            return False
 
-        # first, cancel myself (to make sure I won't restart subactions)
-        logger.debug("Action <%s>: signaling cancelation to action's thread" % self)
+        logger.debug("Action <%s>: signaling cancelation to action's thread", self)
+        if self.cancel_time is None:
+            self.cancel_time = time.time()
         thread.cancel()
+        return True
 
-        # then, tell all the subactions that they should stop
+    def signal_cancel(self):
+        """ Sends the cancellation signal to the action and to all its live
+        sub-actions, without waiting for them to complete.
+
+        Returns the list of the signaled actions (empty if the action itself
+        was not running).
+        """
+
+        # first, cancel myself (to make sure I won't restart subactions)
+        if not self.interrupt():
+            return []
+
+        # then, tell all the live sub-actions (recursively) that they should stop
         # (can not do that in the thread's cancel (_signal_emitter), because the
         # thread may hold locks that are not released until the exception is raised and
         # the context manager are left)
-        logger.debug("Action <%s>: %s subactions to cancel" % (self, len(self.subactions))) #self.actionname
+        subtree = [action for depth, action in self.descendants()]
+        logger.debug("Action <%s>: %s subactions to cancel", self, len(subtree))
 
-        for weak_subaction in self.subactions:
-            subaction = weak_subaction()
-            if subaction:
-                logger.debug("Action <%s>: Cancelling subaction %s..." % (self, subaction))
-                subaction.cancel()
+        for subaction in subtree:
+            logger.debug("Action <%s>: Cancelling subaction %s...", self, subaction)
+            subaction.interrupt()
 
+        return [self] + subtree
 
-        # then, make sure everybody actually terminates
-        logger.debug("Action <%s>: now waiting for completion" % self)
-        try:
-            self.exception(timeout = MAX_TIME_TO_COMPLETE) # waits this amount of time for the task to effectively complete
-        except TimeoutError:
-            raise RuntimeError("Unable to cancel action %s (still running %s after cancellation)!" % (self, MAX_TIME_TO_COMPLETE))
-        logger.debug("Action <%s>: successfully cancelled" % self)
+    def _live_thread(self):
+        """ Returns the thread executing the action, or ``None`` if the
+        action is not running.
+        """
+        if self.thread is None or self.done():
+            return None
+        return self.thread() # weakref!
+
+    def pause(self, timeout = MAX_TIME_TO_COMPLETE):
+        """ Suspends the action and all its live sub-actions, until
+        :meth:`resume` is called. The threads of the actions are parked (cf
+        :meth:`SignalingThread.pause`): the actions keep their state and their
+        resources, and continue where they stopped once resumed. Cancelling a
+        paused action is immediate.
+
+        Blocks until all the actions are actually paused, or at most
+        ``timeout`` seconds. Returns ``True`` if they all are paused (or
+        completed in the meantime).
+
+        Coroutine actions and actions that have not started yet are not
+        paused.
+
+        .. code-block:: python
+
+            nav = robot.goto(kitchen)
+            ...
+            nav.pause() # someone is crossing
+            ...
+            nav.resume()
+        """
+        threads = []
+        for action in [self] + [action for depth, action in self.descendants()]:
+            thread = action._live_thread()
+            if thread is not None:
+                thread.pause()
+                if thread is not threading.current_thread():
+                    threads.append((action, thread))
+
+        logger.debug("Action <%s>: pausing %s threads", self, len(threads))
+        deadline = time.time() + timeout
+        paused = True
+        for action, thread in threads:
+            if not thread.wait_parked(max(0, deadline - time.time())) and not action.done():
+                paused = False
+        return paused
+
+    def resume(self):
+        """ Resumes the action and its sub-actions, paused by :meth:`pause`.
+        """
+        for action in [self] + [action for depth, action in self.descendants()]:
+            thread = action._live_thread()
+            if thread is not None:
+                thread.resume()
+
+    @property
+    def paused(self):
+        """ ``True`` if the action is currently paused (cf :meth:`pause`).
+        """
+        thread = self._live_thread()
+        return thread is not None and thread.parked
+
+    def cancel(self):
+
+        signaled = self.signal_cancel()
+        if not signaled:
+            return
+
+        # then, make sure everybody actually terminates: we wait
+        # MAX_TIME_TO_COMPLETE for the whole subtree to effectively complete
+        logger.debug("Action <%s>: now waiting for completion", self)
+        clock = get_clock()
+        deadline = clock.time() + MAX_TIME_TO_COMPLETE
+        for action in signaled:
+            if not wait(action, max(0, deadline - clock.time())):
+                raise RuntimeError("Unable to cancel action %s (still running %s after cancellation)!" % (action, MAX_TIME_TO_COMPLETE))
+        logger.debug("Action <%s>: successfully cancelled", self)
         #t = 0
         #while t < MAX_TIME_TO_COMPLETE:
         #    time.sleep(ACTIVE_SLEEP_RESOLUTION)
@@ -214,26 +1377,31 @@ class RobotAction(Future):
         #        return
         #raise RuntimeError("Unable to cancel action %s (still running %s after cancellation)!" % (self.actionname, MAX_TIME_TO_COMPLETE))
 
-    def result(self):
-        if self.parent_action and self.parent_action():
-            threading.current_thread().name = "Action %s (waiting for sub-action %s)" % (self.parent_action(), self)
+    def result(self, timeout = None):
+        """ Blocks until the action completes, and returns its result.
+
+        If called from an action, the wait is interrupted as soon as the
+        calling action is cancelled (cf :func:`wait`).
+
+        :param timeout: (default: None) if set, maximum time (in seconds) to
+          wait for. Raises :class:`concurrent.futures.TimeoutError` if the
+          action is still running after that.
+        """
+        parent = self.parent_action() if self.parent_action else None
+        if parent:
+            set_thread_status("Action %s (waiting for sub-action %s)", parent, self)
         else:
-            threading.current_thread().name = "Main thread (waiting for sub-action %s)" % self
+            set_thread_status("Thread waiting for action %s", self)
 
+        if not wait(self, timeout):
+            raise TimeoutError()
 
-        # active wait! Instead of blocking on the condition variable in super.result()
-        # we do an active wait to make sure we can cancel/suspend the action via our
-        # __signal_emitter trace function
-        while True:
-            try:
-                return super(RobotAction, self).result(ACTIVE_SLEEP_RESOLUTION)
-            except TimeoutError:
-                pass
+        return super(RobotAction, self).result(0)
 
-    def wait(self):
+    def wait(self, timeout = None):
         """ alias for result()
         """
-        return self.result()
+        return self.result(timeout)
 
     def __lt__(self, other):
         """ Overrides the comparision operator (used by ==, !=, <, >) to
@@ -262,6 +1430,88 @@ class RobotAction(Future):
     def __str__(self):
         return self.actionname  + "[" + self.__repr__() + "]"
 
+class InlineAction(RobotAction):
+    """ The future returned by inline actions (cf the ``inline`` option of
+    :func:`~robots.concurrency.action.action`): the action has already been
+    executed, synchronously, by the caller.
+
+    It offers the API of :class:`RobotAction`, for a fraction of its cost:
+    the action is not registered in the executor, its id (a uuid) is only
+    generated if needed, and as its state never changes, it needs no lock.
+    """
+
+    # the attributes of RobotAction that an inline action never changes
+    thread = None
+    has_acquired_resource = False
+    admitted = False
+    starting = False
+    priority = 0
+    deadline = None
+    timed_out = False
+    progress_queue = None
+    cancel_time = None
+
+    # set by RobotActionExecutor.run_inline
+    _result = None
+    _exc_info = None # (exception, traceback) raised by the action, if any
+
+    def __init__(self, name, args = (), kwargs = None):
+        # (Future.__init__ only creates the lock and the lists of waiters
+        # and callbacks of the future)
+        self._name = (name, args, kwargs or {})
+        self._actionname = None
+        self._id = None
+
+        self.children = {}
+        self.parent_action = None
+        self.ancestors = frozenset()
+
+        self.executor = None
+
+        self.submit_time = self.start_time = self.run_time = time.time()
+        self.end_time = None
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = uuid.uuid4()
+        return self._id
+
+    def set_timeout(self, timeout):
+        """ No-op: the action has already completed.
+        """
+        pass
+
+    def interrupt(self):
+        return False
+
+    def cancel(self):
+        return False
+
+    def cancelled(self):
+        return False
+
+    def running(self):
+        return False
+
+    def done(self):
+        return True
+
+    def result(self, timeout = None):
+        if self._exc_info is not None:
+            exception, tb = self._exc_info
+            raise type(exception), exception, tb
+        return self._result
+
+    def exception_info(self, timeout = None):
+        return self._exc_info or (None, None)
+
+    def exception(self, timeout = None):
+        return self.exception_info()[0]
+
+    def add_done_callback(self, fn):
+        fn(self)
+
 class FakeFuture:
     """ Used in the 'immediate' mode.
     """
@@ -273,124 +1523,982 @@ class FakeFuture:
     def wait(self):
         return self._result
 
+class DeadlineTimer(threading.Thread):
+    """ The thread cancelling the actions of an executor whose deadline has
+    passed (cf :meth:`RobotAction.set_timeout`).
+
+    Deadlines are kept in a heap. Entries of actions that completed, or
+    whose deadline changed, are simply skipped when they expire (and purged
+    when they make up most of the heap).
+    """
+
+    def __init__(self, executor):
+        threading.Thread.__init__(self, name = "Robot actions deadlines")
+        self.daemon = True
+
+        self.executor = executor
+
+        self.lock = threading.Lock()
+        self.wakeup = WakeupEvent() # set when the earliest deadline changes
+        self.deadlines = [] # heap of (deadline, seq, future)
+        self.seq = itertools.count() # tie-breaker
+        self.nb_done = 0 # number of entries of completed actions in the heap
+
+        self.running = True
+
+    def add(self, future, deadline):
+        with self.lock:
+            heapq.heappush(self.deadlines, (deadline, next(self.seq), future))
+            earliest = self.deadlines[0][2] is future
+
+        if earliest:
+            self.wakeup.set()
+
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        with self.lock:
+            self.nb_done += 1
+            if self.nb_done > 32 and self.nb_done > len(self.deadlines) // 2:
+                self.deadlines = [entry for entry in self.deadlines if not entry[2].done()]
+                heapq.heapify(self.deadlines)
+                self.nb_done = 0
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self is not threading.current_thread():
+            self.join()
+
+    def run(self):
+        clock = get_clock()
+        clock.enter(reserved = True) # cf RobotActionExecutor.add_deadline
+        try:
+            self.process_deadlines(clock)
+        finally:
+            clock.exit()
+
+    def process_deadlines(self, clock):
+        while self.running:
+            # clear *before* checking, so that a new deadline added
+            # in-between is not missed
+            self.wakeup.clear()
+
+            with self.lock:
+                now = clock.time()
+                if not self.deadlines or self.deadlines[0][0] > now:
+                    timeout = self.deadlines[0][0] - now if self.deadlines else None
+                    future = None
+                else:
+                    deadline, seq, future = heapq.heappop(self.deadlines)
+
+            if future is None:
+                clock.wait(self.wakeup, timeout)
+                continue
+
+            if future.done() or future.deadline != deadline:
+                continue # stale entry
+
+            logger.info("Action <%s> timed out: cancelling it", future)
+            future.timed_out = True
+            try:
+                self.executor.timed_out(future)
+                future.signal_cancel()
+            except Exception as e:
+                # the other deadlines must still be enforced
+                logger.error("Error while cancelling the timed out action <%s>: %s", future, e)
+                logger.error(traceback.format_exc())
+
+
+class ActionScope(object):
+    """ Owns the actions started by a thread within a ``with`` block (cf
+    :meth:`RobotActionExecutor.scope`): when the block is left (normally or
+    not), the live actions of the scope, and their sub-actions, are
+    cancelled, and waited for against a single deadline.
+
+    Scopes are nestable: actions are owned by the innermost scope of the
+    thread starting them. Scopes are per thread: actions started by other
+    threads (eg, event callbacks) are not owned by the scope, unless they
+    are sub-actions of an action of the scope.
+    """
+
+    def __init__(self, executor, timeout):
+        self.executor = executor
+        self.timeout = timeout
+
+        self.actions = {} # id(action) -> live action started within the scope
+        self.stuck = [] # actions that ignored the cancellation, cf __exit__
+
+    def add(self, action):
+        self.actions[id(action)] = action
+
+        myself = weakref.ref(self)
+        def unlink(action):
+            scope = myself()
+            if scope is not None:
+                scope.actions.pop(id(action), None)
+        action.add_done_callback(unlink)
+
+    def live_actions(self):
+        """ Returns the list of the live actions owned by the scope.
+        """
+        return self.actions.values()
+
+    def __enter__(self):
+        scopes = self.executor.local.__dict__.setdefault("scopes", [])
+        scopes.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.local.scopes.remove(self)
+
+        actions = self.live_actions()
+        for action in list(actions):
+            actions.extend([subaction for depth, subaction in action.descendants()])
+
+        if actions:
+            logger.debug("Leaving scope: cancelling %s actions", len(actions))
+            self.stuck = self.executor._cancel(actions, self.timeout)
+
+
 class RobotActionExecutor():
+    """ Spawns and keeps track of the robot actions.
+
+    By default, each action is executed in its own, newly created, thread.
+
+    If ``pool_size`` is set, the executor runs instead in *pooled* mode: a
+    bounded set of ``pool_size`` worker threads is started once, and these
+    workers are reused to execute the actions. Actions submitted while all the
+    workers are busy are queued until a worker becomes available (queued
+    actions are started by decreasing priority, cf the ``priority`` option of
+    :func:`~robots.concurrency.action.action`). This significantly reduces
+    the submission latency of short actions.
+
+    .. note:: In pooled mode, an action waiting for one of its sub-actions
+      holds a worker: with deeply nested actions, make sure the pool is large
+      enough to not starve the sub-actions.
+
+    :param pool_size: (default: None) if set, number of pre-started worker
+      threads used to execute the actions.
+    :param cancellation: (default: ``SignalingThread.TRACE``) the cancellation
+      backend used by the action threads. Cf :class:`SignalingThread` for the
+      available backends.
+    :param process_pool_size: (default: number of CPUs) maximum number of
+      worker processes used to execute the actions declared with
+      ``@action(process=True)``.
+
+    The deadlines of the actions (cf :meth:`RobotAction.set_timeout`) are
+    all enforced by a single :class:`DeadlineTimer` thread, started on
+    demand.
+
+    At most ``max_actions`` actions are executed in parallel. When this
+    limit is reached, newly submitted actions are handled according to the
+    ``admission`` policy:
+
+    - :attr:`REJECT`: :class:`.ActionRejected` is raised,
+    - :attr:`QUEUE`: the action is queued (FIFO), and started when another
+      action completes (or blocks on a resource). If ``max_queued`` actions are already queued,
+      :class:`.ActionRejected` is raised,
+    - :attr:`DROP_OLDEST`: as :attr:`QUEUE`, but if the queue is full, the
+      oldest queued action is cancelled to make room for the new one.
+
+    Only the running actions, ie the actions that have acquired their
+    resources, count toward ``max_actions``: actions serialized on a
+    resource are waiting, not running. Sub-actions of running actions are
+    always admitted (their parent may not be able to complete without
+    them). Cf :meth:`admission_stats`.
+
+    :param max_actions: (default: :data:`MAX_FUTURES`) maximum number of
+      actions executed in parallel.
+    :param admission: (default: :attr:`REJECT`) the admission policy.
+    :param max_queued: (default: 100) maximum length of the queue of
+      actions waiting for admission.
+    :param stack_size: (default: None, ie the system default, usually 8MB
+      of virtual memory on Linux) stack size, in bytes, of the threads
+      started by the executor (action threads, workers, event monitors...).
+      Must be at least 32KB; deeply recursive actions may need 256KB or
+      more. Cf :meth:`thread_stats`.
+    """
 
-    def __init__(self):
+    QUEUE = "queue"
+    REJECT = "reject"
+    DROP_OLDEST = "drop oldest"
+
+    # coalescing policies, cf coalesce
+    JOIN = "join"
+    REPLACE = "replace"
+    DROP = "drop"
+
+    def __init__(self, pool_size = None, cancellation = SignalingThread.TRACE, process_pool_size = None,
+                 max_actions = None, admission = REJECT, max_queued = 100,
+                 stack_size = None):
+
+        self.cancellation = cancellation
+
+        if stack_size is not None and stack_size < 32768:
+            raise ValueError("The stack size of the threads must be at least 32KB (got %s bytes)" % stack_size)
+        self.stack_size = stack_size
+
+        # threads started by the executor, cf start_thread
+        self.threads = weakref.WeakSet()
+        self.threads_lock = threading.Lock()
 
         # Attention, RobotActionExecutor must be thread-safe
-        self.futures = []
+
+        # id(future) -> future, for every action not done yet. Actions are
+        # removed by a done callback (cf _remove).
+        self.futures = {}
+        # number of actions in self.futures that have acquired their
+        # resources (ie, are actually running)
+        self.nb_active = 0
 
         self.futures_lock = threading.Lock()
 
+        # per-thread stacks of ActionScopes (attribute 'scopes'), cf scope
+        self.local = threading.local()
+
+        # thread ident -> action currently executed by this thread.
+        # Only modified by the action threads themselves (dict item
+        # assignment/removal are atomic): no lock needed.
+        self.actions_by_thread = {}
+
+        self.pool_size = pool_size
+        self.workers = []
+
+        # created on demand, by submit_coroutine, run_in_process, add_deadline
+        # and start_profiler
+        self.coroutine_loop = None
+        self.deadline_timer = None
+        self.profiler = None
+        self.process_pool = None
+        self.process_pool_size = process_pool_size
+
+        # admission control
+        self.max_actions = max_actions or MAX_FUTURES
+        self.admission = admission
+        self.max_queued = max_queued
+        # number of actions started from the admission queue, that have
+        # neither acquired their resources nor blocked waiting for them yet
+        self.nb_starting = 0
+        self.admission_queue = deque() # (future, start function, time of submission)
+        self.nb_rejected = 0
+        self.nb_dropped = 0
+        self.max_queue_length = 0
+        self.admission_waits = [0, 0., 0.] # number, total and max time spent in admission_queue
+
+        # coalesced actions (cf coalesce): key -> running action, and
+        # number of coalesced calls, per policy
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        self.nb_coalesced = {RobotActionExecutor.JOIN: 0,
+                             RobotActionExecutor.REPLACE: 0,
+                             RobotActionExecutor.DROP: 0}
+
+        # number of actions that timed out: in total, and per action
+        self.nb_timed_out = 0
+        self.timed_out_actions = {}
+
+        # action name -> {phase -> LatencyHistogram}, cf lifecycle_stats
+        self.lifecycle = {}
+
+        # latencies of the pauses of the actions, cf pause_stats
+        self.pause_latencies = {"pause": LatencyHistogram(), "resume": LatencyHistogram()}
+
+        # pooled mode: number of workers waiting for a job, and number of
+        # clock reservations made for them (cf reserve_workers)
+        self.pool_lock = threading.Lock()
+        self.idle_workers = pool_size or 0
+        self.clock_reservations = 0
+
+        if pool_size:
+            self.jobs = Queue.PriorityQueue() # (-priority, seq, job)
+            self.seq = itertools.count() # FIFO order among equal priorities
+            for i in range(pool_size):
+                worker = RobotActionWorker(self, self.jobs)
+                self.start_thread(worker)
+                # (idle workers do not participate in the clock: cf reserve_workers)
+                self.workers.append(worker)
+
+    def reserve_workers(self):
+        """ Pooled mode: reserves the clock (cf :mod:`robots.concurrency.clock`)
+        for the idle workers about to pick up a queued job. Jobs queued while
+        every worker is busy are not accounted for: otherwise, the clock would
+        never advance if the busy workers are all sleeping.
+
+        Called with ``pool_lock`` held. The reservations are consumed by the
+        workers when they dequeue a job (cf :meth:`RobotActionWorker.run`).
+        """
+        clock = get_clock()
+        while self.clock_reservations < min(self.idle_workers, self.jobs.qsize()):
+            self.clock_reservations += 1
+            clock.reserve()
+
+    def start_thread(self, thread):
+        """ Starts ``thread`` with the executor's stack size, and accounts for
+        it in :meth:`thread_stats`.
+        """
+        with self.threads_lock:
+            self.threads.add(thread)
+        start_thread(thread, self.stack_size)
+
+    def thread_stats(self):
+        """ Returns the number of live threads started by the executor, and
+        their approximate memory cost, as a dictionary:
+
+        - ``total``: number of threads,
+        - ``types``: number of threads per class (eg ``RobotActionThread``,
+          ``SignalingThread`` for event monitors...),
+        - ``stack size``: stack size of each thread, in bytes (``None`` if
+          unknown),
+        - ``stack memory``: virtual memory reserved for the stacks of these
+          threads (only the pages actually used are resident),
+        - ``process``: virtual and resident memory of the whole process,
+          cf :func:`process_memory`.
+        """
+        with self.threads_lock:
+            threads = [t for t in self.threads if t.is_alive()]
+
+        types = {}
+        for t in threads:
+            name = type(t).__name__
+            types[name] = types.get(name, 0) + 1
+
+        stack_size = self.stack_size or default_stack_size()
+        return {"total": len(threads),
+                "types": types,
+                "stack size": stack_size,
+                "stack memory": len(threads) * stack_size if stack_size else None,
+                "process": process_memory()}
+
+    def pool_stats(self):
+        """ Returns the state of the pool of workers as a dictionary with keys
+        ``size`` (number of workers), ``queued`` (number of actions waiting for
+        a worker) and ``idle`` (number of workers currently waiting for an
+        action).
+
+        Returns ``None`` if the executor is not in pooled mode.
+        """
+        if not self.pool_size:
+            return None
+
+        return {"size": len(self.workers),
+                "queued": self.jobs.qsize(),
+                "idle": len([w for w in self.workers if w.idle()])}
+
+    def shutdown(self):
+        """ Stops the pool of workers and the coroutine loop (if any), once
+        the actions already submitted have completed.
+        """
+        if self.coroutine_loop is not None:
+            self.coroutine_loop.stop()
+            self.coroutine_loop = None
+
+        if self.deadline_timer is not None:
+            self.deadline_timer.stop()
+            self.deadline_timer = None
+
+        self.stop_profiler()
+
+        if self.process_pool is not None:
+            self.process_pool.close()
+            self.process_pool = None
+
+        workers, self.workers = self.workers, []
+
+        for worker in workers:
+            # after all the pending jobs
+            with self.pool_lock:
+                self.jobs.put((float("inf"), next(self.seq), None))
+                self.reserve_workers()
+
+        for worker in workers:
+            if worker is not threading.current_thread():
+                worker.join()
+
     def submit(self, fn, *args, **kwargs):
+        with shielded_caller():
+            return self._submit(fn, args, kwargs)
+
+    def _submit(self, fn, args, kwargs):
+
+        f = self._new_action(RobotAction, fn, args, kwargs)
+
+        # the clock (cf robots.concurrency.clock) must not advance until the
+        # action actually starts (the reservation is consumed by the thread)
+        if self.workers:
+            def start():
+                with self.pool_lock:
+                    self.jobs.put((-f.priority, next(self.seq), (f, fn, args, kwargs)))
+                    self.reserve_workers()
+        else:
+            def start():
+                # no need to wait for the thread to actually start: the future is
+                # fully initialized at this point, and the thread registers itself in
+                # actions_by_thread before running the action.
+                t = RobotActionThread(self, f, fn, args, kwargs)
+                f.set_thread(weakref.ref(t))
+
+                get_clock().reserve()
+                self.start_thread(t)
+
+        self._admit(f, start)
+        self._propagate_pending_cancel(f)
+        return f
+
+    def _propagate_pending_cancel(self, future):
+        """ Cancels the new sub-action ``future`` if its parent has been
+        cancelled while submitting it: the parent only raises
+        :class:`ActionCancelled` once the submission is complete (cf
+        :func:`shielded_caller`), and its cancellation may have missed the
+        sub-action (cf :meth:`RobotAction.signal_cancel`).
+        """
+        if future.parent_action is None:
+            return
+        thread = threading.current_thread()
+        if isinstance(thread, SignalingThread) and thread.cancel_pending:
+            logger.debug("Action <%s> submitted while its parent was being cancelled: cancelling it", future)
+            future.signal_cancel()
+
+    def submit_coroutine(self, fn, *args, **kwargs):
+        """ Schedules the coroutine action ``fn`` (a generator function) on
+        the executor's coroutine loop (cf :mod:`robots.concurrency.coroutines`).
+
+        Unlike :meth:`submit`, ``fn`` is the action itself: the resources it
+        locks are acquired by the coroutine loop.
+        """
+        from .coroutines import CoroutineAction, CoroutineLoop
+
+        with shielded_caller(): # cf submit
+            f = self._new_action(CoroutineAction, fn, args, kwargs)
+
+            with self.futures_lock:
+                if self.coroutine_loop is None:
+                    self.coroutine_loop = CoroutineLoop(self)
+                    get_clock().reserve()
+                    self.start_thread(self.coroutine_loop)
+
+            self._admit(f, partial(self.coroutine_loop.start_task, f, fn, args, kwargs))
+            self._propagate_pending_cancel(f)
+        return f
+
+    def run_in_process(self, fn, args, kwargs):
+        """ Executes ``fn(None, *args, **kwargs)`` in the executor's pool of
+        processes, and returns the result (cf :mod:`robots.concurrency.processes`).
+
+        Called from the thread of the action.
+        """
+        from .processes import ProcessPool
+
+        with self.futures_lock:
+            if self.process_pool is None:
+                self.process_pool = ProcessPool(self.process_pool_size)
+
+        return self.process_pool.run(fn, args, kwargs)
+
+    def start_profiler(self, rate = None):
+        """ Starts sampling the stacks of the running actions, ``rate`` times
+        per second (default: :data:`robots.concurrency.profiler.DEFAULT_RATE`),
+        and returns the :class:`~robots.concurrency.profiler.SamplingProfiler`.
+        If the profiler is already running, it is returned as is.
+        """
+        from .profiler import SamplingProfiler, DEFAULT_RATE
 
         with self.futures_lock:
-            self.futures = [f for f in self.futures if not f.done()]
+            if self.profiler is None:
+                self.profiler = SamplingProfiler(self, rate or DEFAULT_RATE)
+                self.start_thread(self.profiler)
+            return self.profiler
+
+    def stop_profiler(self):
+        """ Stops the profiler started by :meth:`start_profiler`, and returns
+        it (``None`` if it was not running).
+        """
+        with self.futures_lock:
+            profiler, self.profiler = self.profiler, None
 
+        if profiler is not None:
+            profiler.stop()
+        return profiler
 
-        name = fn.__name__
-        if args and not kwargs:
-            name += "(%s)" % ", ".join([str(a) for a in args[1:]]) # start at 1 because 0 is the robot instance
-        elif kwargs and not args:
-            name += "(%s)" % ", ".join(["%s=%s" % (str(k), str(v)) for k, v in kwargs.items()])
-        elif args and kwargs:
-            name += "(%s, " % ", ".join([str(a) for a in args[1:]])
-            name += "%s)" % ", ".join(["%s=%s" % (str(k), str(v)) for k, v in kwargs.items()])
+    def add_deadline(self, future, deadline):
+        """ Cancels ``future`` if it is still running at time ``deadline``
+        (cf :meth:`RobotAction.set_timeout`).
+        """
+        with self.futures_lock:
+            if self.deadline_timer is None:
+                self.deadline_timer = DeadlineTimer(self)
+                get_clock().reserve()
+                self.start_thread(self.deadline_timer)
 
-        if len([f for f in self.futures if f.has_acquired_resource]) > MAX_FUTURES:
-            raise RuntimeError("You have more than %s actions running in parallel! Likely a bug in your application logic!" % MAX_FUTURES)
+        self.deadline_timer.add(future, deadline)
 
-        f = RobotAction(name)
+    def timed_out(self, future):
+        """ Called by the deadline timer when ``future`` times out.
+        """
+        with self.futures_lock:
+            self.nb_timed_out += 1
+            name = future._name[0]
+            self.timed_out_actions[name] = self.timed_out_actions.get(name, 0) + 1
+
+    def timeout_stats(self):
+        """ Returns the number of actions that have been cancelled because
+        they timed out, as a dictionary ``{"total": <count>, "actions":
+        {<action name>: <count>}}``.
+        """
+        with self.futures_lock:
+            return {"total": self.nb_timed_out,
+                    "actions": dict(self.timed_out_actions)}
 
-        initialized = threading.Event()
+    def _new_action(self, cls, fn, args, kwargs):
+        """ Creates and registers a new action future of class ``cls`` for
+        ``fn``, and links it to the calling action, if any.
+        """
+        f = cls(fn.__name__, args[1:], kwargs) # args[0] is the robot instance
+        f.priority = getattr(fn, "_priority", 0)
+        f.executor = self
 
+        with self.futures_lock:
+            self.futures[id(f)] = f
+        f.add_done_callback(self._remove)
 
-        t = RobotActionThread(f, initialized, fn, args, kwargs)
-        f.set_thread(weakref.ref(t))
+        timeout = getattr(fn, "_timeout", None)
+        if timeout is not None:
+            f.set_timeout(timeout)
 
+        progress = getattr(fn, "_progress", None)
+        if progress is not None:
+            f.progress_queue = ProgressQueue(*progress)
+            f.add_done_callback(lambda f: f.progress_queue.close())
 
         current_action = self.get_current_action()
         if current_action:
-            f.set_parent(weakref.ref(current_action))
-            current_action.add_subaction(weakref.ref(f))
+            f.set_parent(current_action)
+            current_action.add_subaction(f)
 
+        scopes = getattr(self.local, "scopes", None)
+        if scopes:
+            scopes[-1].add(f)
 
-        t.start()
+        return f
 
-        while not initialized.is_set():
-            # waits for the thread to actually start
-            pass
+    def scope(self, timeout = MAX_TIME_TO_COMPLETE):
+        """ Returns a new :class:`ActionScope`, a context manager that owns
+        the actions started by the calling thread within the ``with`` block.
+        When the block is left, the actions still running are cancelled,
+        and given together ``timeout`` seconds to stop. The actions that
+        ignored the cancellation are then listed in the ``stuck`` attribute
+        of the scope.
 
-        with self.futures_lock:
-            self.futures.append(f)
+        .. code-block:: python
+
+            with executor.scope() as scope:
+                executor.submit(...)
+                ...
+            # here, all the actions submitted in the block are done
+        """
+        return ActionScope(self, timeout)
 
+    def run_inline(self, fn, args, kwargs):
+        """ Executes the inline action ``fn`` in the calling thread (cf the
+        ``inline`` option of :func:`~robots.concurrency.action.action`), and
+        returns its completed :class:`InlineAction`.
+
+        Called from another action, ``fn`` runs as part of this enclosing
+        action: cancelling it interrupts ``fn``, and the
+        :class:`.ActionCancelled` signal propagates to the enclosing action.
+        """
+        f = InlineAction(fn.__name__, args[1:], kwargs) # args[0] is the robot instance
+        f.executor = self
+
+        current_action = self.actions_by_thread.get(thread.get_ident())
+        if current_action is not None:
+            f.set_parent(current_action)
+            caller = threading.current_thread()
+            if isinstance(caller, SignalingThread):
+                caller.checkpoint() # the enclosing action may already be cancelled
+
+        try:
+            f._result = fn(*args, **kwargs)
+        except ActionCancelled:
+            raise
+        except Exception:
+            e, tb = sys.exc_info()[1:]
+            logger.error("Exception in action <%s>: %s", f, e)
+            logger.error(traceback.format_exc())
+            f._exc_info = (e, tb)
+
+        f.end_time = time.time()
         return f
 
-    def get_current_action(self):
-        """Returns the RobotAction linked to the current thread.
+    def coalesce(self, policy, fn, args, kwargs, submit):
+        """ Starts the action ``fn`` by calling ``submit`` (that returns its
+        future), unless a previous call of ``fn`` with the same arguments is
+        still running. In this case, the new call is coalesced with the
+        running one, according to ``policy`` (cf the ``coalesce`` option of
+        :func:`~robots.concurrency.action.action`):
+
+        - :attr:`JOIN`: returns the future of the running call,
+        - :attr:`REPLACE`: cancels the running call (without waiting for it)
+          and starts the new one,
+        - :attr:`DROP`: returns an already completed future (an
+          :class:`InlineAction`), with ``None`` as result.
+
+        Calls with unhashable arguments, and calls from the running action
+        itself (or from its sub-actions), are not coalesced.
+        """
+        key = (fn, args[1:], tuple(sorted(kwargs.items()))) # args[0] is the robot instance
+        try:
+            hash(key)
+        except TypeError:
+            return submit()
+
+        current_action = self.actions_by_thread.get(thread.get_ident())
+
+        with self.inflight_lock:
+            running = self.inflight.get(key)
+            if running is not None and not running.done() and \
+               not (current_action is not None and
+                    (current_action is running or current_action.childof(running))):
+
+                self.nb_coalesced[policy] += 1
+
+                if policy == RobotActionExecutor.JOIN:
+                    logger.debug("Action <%s> already running: joining it", running)
+                    return running
+
+                if policy == RobotActionExecutor.DROP:
+                    logger.debug("Action <%s> already running: dropping the new call", running)
+                    f = InlineAction(fn.__name__, args[1:], kwargs)
+                    f.executor = self
+                    return f
+
+                logger.debug("Action <%s> already running: replacing it", running)
+                running.signal_cancel()
+
+            future = submit()
+            if not isinstance(future, RobotAction): # resource not available, cf @lock(wait=False)
+                return future
+            self.inflight[key] = future
+
+        # (outside of the lock: called right away if the future is already done)
+        future.add_done_callback(partial(self._forget_inflight, key))
+        return future
+
+    def _forget_inflight(self, key, future):
+        with self.inflight_lock:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def coalescing_stats(self):
+        """ Returns the number of coalesced calls (cf :meth:`coalesce`), per
+        policy, and the number of coalescable actions currently running, as a
+        dictionary ``{"join": <count>, "replace": <count>, "drop": <count>,
+        "running": <count>}``.
         """
-        thread_id = threading.current_thread().ident
+        with self.inflight_lock:
+            stats = dict(self.nb_coalesced)
+            stats["running"] = len([f for f in self.inflight.values() if not f.done()])
+        return stats
+
+    def waiting_for_resources(self, future):
+        """ Called when the action ``future`` is about to block on a resource:
+        until it acquires its resources, it does not count toward
+        ``max_actions``.
+        """
+        with self.futures_lock:
+            if not future.starting:
+                return
+            future.starting = False
+            self.nb_starting -= 1
+            to_start = self._admit_queued()
+
+        for start in to_start:
+            start()
+
+    def resources_acquired(self, future):
+        """ Called when the action ``future`` has acquired its resources, and
+        is actually starting.
+        """
+        future.run_time = time.time()
+        with self.futures_lock:
+            if future.starting:
+                future.starting = False
+                self.nb_starting -= 1
+            if not future.has_acquired_resource and id(future) in self.futures:
+                future.has_acquired_resource = True
+                self.nb_active += 1
+
+    def _admit(self, future, start):
+        """ Starts the new action ``future`` (by calling ``start``) if the
+        admission control allows it, or queues/rejects it according to the
+        admission policy.
+        """
+        rejected = False
+        dropped = None
 
         with self.futures_lock:
+            if future.parent_action is not None or \
+               (self.nb_active + self.nb_starting < self.max_actions and not self.admission_queue):
+                future.admitted = True
 
-            for f in self.futures:
-                if not f.done():
+            else:
+                queue = self.admission_queue
+                if len(queue) >= self.max_queued:
+                    # purge the actions cancelled while queued
+                    self.admission_queue = queue = deque([entry for entry in queue if not entry[0].done()])
+
+                if self.admission == RobotActionExecutor.REJECT or \
+                   (self.admission == RobotActionExecutor.QUEUE and len(queue) >= self.max_queued):
+                    self.nb_rejected += 1
+                    rejected = True
+                else:
+                    if len(queue) >= self.max_queued:
+                        dropped = queue.popleft()[0]
+                        self.nb_dropped += 1
+                    queue.append((future, start, time.time()))
+                    self.max_queue_length = max(self.max_queue_length, len(queue))
+                start = None
+
+        if dropped is not None:
+            logger.warning("Too many actions: dropping queued action <%s>", dropped)
+            Future.cancel(dropped)
+
+        if rejected:
+            Future.cancel(future)
+            raise ActionRejected("Action <%s> rejected: %s actions are already running" % (future, self.max_actions))
+
+        if start is not None:
+            start()
+
+    def _remove(self, future):
+        """ Done callback of the actions.
+        """
+        future.end_time = time.time()
 
-                    thread = f.thread() # weak ref
-                    if thread is not None and thread.ident == thread_id:
-                        return f
+        with self.futures_lock:
+            if self.futures.pop(id(future), None) is not None and future.has_acquired_resource:
+                self.nb_active -= 1
+            if future.starting:
+                future.starting = False
+                self.nb_starting -= 1
 
-        logger.debug("The current thread (<%s>) is not a robot action (main thread?)" % threading.current_thread().name)
-        return None
+            self._record_lifecycle(future)
 
-    def cancel_all(self):
-        """ Blocks until all the currently running actions are actually stopped.
+            to_start = self._admit_queued()
+
+        for start in to_start:
+            start()
+
+    def _admit_queued(self):
+        """ Admits the queued actions, as long as there is room for them.
+        Returns their start functions. Must be called with ``futures_lock``
+        held.
+        """
+        to_start = []
+        now = time.time()
+        while self.admission_queue and self.nb_active + self.nb_starting < self.max_actions:
+            f, start, submit_time = self.admission_queue.popleft()
+            if f.done(): # cancelled while queued
+                continue
+            # counted until it runs (or blocks on a resource), so that the
+            # whole queue is not started at once
+            self.nb_starting += 1
+            f.admitted = f.starting = True
+            waits = self.admission_waits
+            waits[0] += 1
+            waits[1] += now - submit_time
+            waits[2] = max(waits[2], now - submit_time)
+            to_start.append(start)
+        return to_start
+
+    PHASES = ("queued", "resource wait", "run", "cancel")
+
+    def _record_lifecycle(self, future):
+        """ Adds the durations of the phases of the completed action
+        ``future`` to the histograms of its action. Must be called with
+        ``futures_lock`` held.
+        """
+        name = future._name[0]
+        histograms = self.lifecycle.get(name)
+        if histograms is None:
+            histograms = self.lifecycle[name] = dict((phase, LatencyHistogram())
+                                                     for phase in RobotActionExecutor.PHASES)
+
+        end = future.end_time
+        if future.start_time is not None:
+            histograms["queued"].add(future.start_time - future.submit_time)
+            if future.run_time is not None:
+                histograms["resource wait"].add(future.run_time - future.start_time)
+                histograms["run"].add(end - future.run_time)
+        if future.cancel_time is not None:
+            histograms["cancel"].add(end - future.cancel_time)
+
+    def lifecycle_stats(self, name = None):
+        """ Returns the statistics of the lifecycle of the completed actions,
+        per action name and phase, as ``{<action name>: {<phase>: <histogram>}}``
+        where histograms are summarized by :meth:`LatencyHistogram.to_dict`.
+
+        The phases are:
+
+        - ``queued``: from the submission to the beginning of the execution
+          by a thread (or by the coroutine loop),
+        - ``resource wait``: time spent waiting for the locked resources,
+        - ``run``: execution of the action body,
+        - ``cancel``: from the first cancellation request to the effective
+          completion of the action.
+
+        :param name: (default: None) if set, only returns the statistics of
+          this action, as ``{<phase>: <histogram>}`` (``None`` if no
+          ``name`` action has completed yet).
+        """
+        with self.futures_lock:
+            if name is not None:
+                histograms = self.lifecycle.get(name)
+                if histograms is None:
+                    return None
+                return dict((phase, h.to_dict()) for phase, h in histograms.items())
+
+            return dict((action, dict((phase, h.to_dict()) for phase, h in histograms.items()))
+                        for action, histograms in self.lifecycle.items())
+
+    def record_pause(self, pause_latency, resume_latency):
+        """ Called by the action threads when they resume after a pause,
+        cf :meth:`.SignalingThread.pause_completed`.
+        """
+        with self.futures_lock:
+            self.pause_latencies["pause"].add(pause_latency)
+            if resume_latency is not None:
+                self.pause_latencies["resume"].add(resume_latency)
+
+    def pause_stats(self):
+        """ Returns the histograms (cf :meth:`LatencyHistogram.to_dict`) of
+        the time taken by the paused actions to actually stop (``pause``),
+        and to restart once resumed (``resume``), cf
+        :meth:`RobotAction.pause`.
         """
+        with self.futures_lock:
+            return dict((kind, h.to_dict()) for kind, h in self.pause_latencies.items())
 
+    def reset_lifecycle_stats(self):
+        with self.futures_lock:
+            self.lifecycle.clear()
+
+    def admission_stats(self):
+        """ Returns metrics on the admission control, as a dictionary:
+
+        - ``active``: number of actions currently running (ie, that have
+          acquired their resources),
+        - ``queued``: number of actions currently waiting for admission,
+        - ``max_queued``: maximum length reached by the queue,
+        - ``rejected``, ``dropped``: number of rejected/dropped actions,
+        - ``wait``: ``{"count", "mean", "max"}``, time (in seconds) spent by
+          the queued actions before being admitted.
+        """
         with self.futures_lock:
-            for f in self.futures:
-                if not f.done():
-                    f.cancel()
+            count, total, longest = self.admission_waits
+            return {"active": self.nb_active,
+                    "queued": len([entry for entry in self.admission_queue if not entry[0].done()]),
+                    "max_queued": self.max_queue_length,
+                    "rejected": self.nb_rejected,
+                    "dropped": self.nb_dropped,
+                    "wait": {"count": count,
+                             "mean": total / count if count else 0.,
+                             "max": longest}}
+
+    def roots(self):
+        """ Returns the live actions that have not been spawned by another
+        live action, ie, the roots of the trees of actions (cf
+        :meth:`RobotAction.tree`).
+        """
+        roots = []
+        for f in self.live_actions():
+            parent = f.parent_action() if f.parent_action else None
+            if parent is None or parent.done():
+                roots.append(f)
+        return roots
+
+    def get_current_action(self):
+        """Returns the RobotAction linked to the current thread.
+        """
+        current_action = self.actions_by_thread.get(thread.get_ident())
+        if current_action is not None:
+            return current_action
+
+        logger.debug("The current thread (<%s>) is not a robot action (main thread?)", threading.current_thread().name)
+        return None
+
+    def cancel_all(self, timeout = MAX_TIME_TO_COMPLETE):
+        """ Blocks until all the currently running actions are actually stopped,
+        or ``timeout`` seconds have elapsed.
 
-            self.futures = []
+        If called from an action, this action is cancelled as well, *after*
+        the other actions have stopped.
 
-    def cancel_all_others(self):
+        Returns the list of the actions that ignored the cancellation (ie,
+        that are still running after ``timeout``).
+        """
+        myself = self.get_current_action()
+
+        stuck = self._cancel([f for f in self.live_actions() if f is not myself], timeout)
+
+        if myself:
+            myself.interrupt()
+
+        return stuck
+
+    def cancel_all_others(self, timeout = MAX_TIME_TO_COMPLETE):
         """ Blocks until all the currently running actions *except the calling
-        one* are actually stopped.
+        one* are actually stopped, or ``timeout`` seconds have elapsed.
 
+        Returns the list of the actions that ignored the cancellation (ie,
+        that are still running after ``timeout``).
         """
 
-        thread_id = threading.current_thread().ident
+        myself = self.get_current_action()
+
+        return self._cancel([f for f in self.live_actions() if f is not myself], timeout)
 
+    def live_actions(self):
+        """ Returns the list of the actions not done yet.
+        """
         with self.futures_lock:
-            for f in self.futures:
-                if not f.done():
-                    thread = f.thread() # weak ref
-                    if thread is not None and thread.ident == thread_id:
-                        myself = f
-                        continue
+            return self.futures.values()
+
+    def _cancel(self, futures, timeout):
+        """ Signals all the ``futures`` first, and then waits for all of them
+        to complete against a single deadline. Does not hold
+        ``futures_lock`` (the actions remove themselves from self.futures on
+        completion).
 
-                    f.cancel()
+        Returns the actions still running after ``timeout``.
+        """
+        signaled = [f for f in futures if f.interrupt()]
 
-            self.futures = [myself]
+        clock = get_clock()
+        deadline = clock.time() + timeout
+        stuck = []
+        for f in signaled:
+            if not wait(f, max(0, deadline - clock.time())):
+                stuck.append(f)
 
+        for f in stuck:
+            logger.warning("Action <%s> ignored the cancellation request (still running %ss after cancellation)!", f, timeout)
 
+        return stuck
 
     def actioninfo(self, future_id):
 
         with self.futures_lock:
 
-            future = [f for f in self.futures if id(f) == future_id]
+            future = self.futures.get(future_id)
 
-            if not future:
+            if future is None:
                 return "No task with ID %s. Maybe the task is already done?" % future_id
 
-            future = future[0]
-
 
             desc = "Task <%s>\n" % future
 
-            thread = future.thread() # weak ref
+            thread = future.thread() if future.thread else None # weak ref
             if thread:
                 frame = sys._current_frames()[thread.ident]
                 tb = traceback.extract_stack(frame, limit = 6)
@@ -403,7 +2511,9 @@ class RobotActionExecutor():
                 return "Task ID %s is already done." % future_id
 
     def __str__(self):
-        with self.futures_lock:
-            return "Running tasks:\n" + \
-                    "\n".join(["Task %s (id: %s, thread: <%s>)" % (f, id(f), str(f.thread())) for f in self.futures if not f.done()])
+        desc = "Running tasks:"
+        for root in self.roots():
+            for depth, f in [(0, root)] + list(root.descendants()):
+                desc += "\n" + "  " * depth + "Task %s (id: %s, thread: <%s>)" % (f, id(f), str(f.thread() if f.thread else "queued"))
+        return desc
 
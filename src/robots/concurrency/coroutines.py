@@ -0,0 +1,311 @@
+# coding=utf-8
+"""
+Coroutine-based actions.
+
+Actions declared with ``@action(coroutine=True)`` are generator functions
+that are not executed in their own thread, but as lightweight tasks on a
+single loop thread owned by the robot's executor. This scales to many
+concurrent I/O-bound actions (actions that mostly wait for time to pass or
+for other actions to complete).
+
+The coroutine *yields* what it wants to wait for:
+
+- a number: sleeps that many seconds,
+- a future (typically, another action): waits for its completion. The
+  ``yield`` expression evaluates to the result of the future (or raises its
+  exception),
+- ``None``: simply yields control to the other tasks.
+
+The result of the action is passed to ``StopIteration`` (``raise
+StopIteration(result)`` with Python 2, ``return result`` with Python 3).
+
+.. code-block:: python
+
+    @action(coroutine=True)
+    @lock(HEAD)
+    def look_around(robot):
+        for angle in [-1, 0, 1]:
+            yield robot.look_at([1, angle, 0])
+            yield 0.5 # sleeps 0.5s
+
+        raise StopIteration("done")
+
+Cancelling a coroutine action raises :class:`.ActionCancelled` at the
+current ``yield`` of the coroutine.
+
+.. warning:: Coroutines must never block (no ``robot.sleep``, no
+  ``action.result()``...): this would block every other coroutine action.
+  Yield instead.
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+
+from concurrent.futures import Future
+
+from .signals import ActionCancelled
+from .concurrency import RobotAction
+from .clock import WakeupEvent, get_clock
+
+class CoroutineAction(RobotAction):
+    """ The future returned by coroutine actions.
+    """
+    def __init__(self, name, args = (), kwargs = None):
+        RobotAction.__init__(self, name, args, kwargs)
+        self.task = None
+
+    def interrupt(self):
+        if self.task is None:
+            # still waiting for admission (cf RobotActionExecutor._admit)
+            if Future.cancel(self):
+                logger.debug("Action <%s>: cancelled before starting", self)
+            else:
+                logger.debug("Action <%s>: already done", self)
+            return False
+
+        if self.done():
+            logger.debug("Action <%s>: already done", self)
+            return False
+
+        logger.debug("Action <%s>: signaling cancelation to the coroutine", self)
+        if self.cancel_time is None:
+            self.cancel_time = time.time()
+        self.task.cancel()
+        return True
+
+    def cancel(self):
+        if self.task is not None and threading.current_thread() is self.task.loop:
+            # cancelled from another coroutine: we can not block the loop
+            # waiting for the cancellation to complete.
+            self.signal_cancel()
+            return
+
+        RobotAction.cancel(self)
+
+
+class CoroutineTask(object):
+    """ Drives the execution of one coroutine action.
+    """
+    def __init__(self, loop, future, fn, args, kwargs):
+        self.loop = loop
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+        # resources to acquire (with wait=True) before starting the coroutine.
+        # All the locked resources are released on completion (the ones
+        # with wait=False have been acquired at submission).
+        locked_res = getattr(fn, "_locked_res", [])
+        self.to_acquire = []
+        for res, wait in locked_res:
+            if wait:
+                # compound resources are acquired one resource at a time
+                self.to_acquire.extend(getattr(res, "resources", [res]))
+        self.to_release = [res for res, wait in locked_res if not wait]
+        self.waiter = None # pending request on self.to_acquire[0], cf acquire_resources
+
+        self.coroutine = None
+
+        # identifies what the task is currently waiting for: wake-ups
+        # carrying another token are stale, and ignored
+        self.token = None
+
+    def cancel(self):
+        self.loop.schedule(self, None, exc = ActionCancelled())
+
+    def step(self, value = None, exc = None):
+
+        if self.future.done():
+            return
+
+        executor = self.loop.executor
+        executor.actions_by_thread[self.loop.ident] = self.future
+        if self.future.start_time is None:
+            self.future.start_time = time.time()
+
+        try:
+            if self.coroutine is None:
+                if exc is not None:
+                    # cancelled while waiting for resources
+                    logger.debug("Action <%s> cancelled while it was waiting for a lock on a resource.", self.future)
+                    if self.waiter is not None:
+                        self.to_acquire[0].abandon(self.waiter)
+                        self.waiter = None
+                    self.complete(result = None)
+                    return
+
+                if not self.acquire_resources():
+                    # resumed by the resource hand-over
+                    executor.waiting_for_resources(self.future)
+                    return
+
+                executor.resources_acquired(self.future)
+                self.coroutine = self.fn(*self.args, **self.kwargs)
+                exc = None
+                value = None
+
+            try:
+                if exc is not None:
+                    awaited = self.coroutine.throw(exc)
+                else:
+                    awaited = self.coroutine.send(value)
+            except StopIteration as e:
+                self.complete(result = e.args[0] if e.args else None)
+                return
+            except BaseException as e:
+                logger.error("Exception in action <%s>: %s", self.future, e)
+                self.complete(exception = e)
+                return
+
+            self.wait_for(awaited)
+
+        finally:
+            executor.actions_by_thread.pop(self.loop.ident, None)
+
+    def acquire_resources(self):
+        """ Acquires the resources in turn, without blocking the loop: when
+        a resource is not available, the task is queued with the other
+        waiters of the resource (cf :meth:`.Resource.request`), and resumed
+        when the resource is handed over to it. Returns ``True`` once all
+        the resources are acquired.
+        """
+        while self.to_acquire:
+            res = self.to_acquire[0]
+            if self.waiter is not None:
+                if not self.waiter.granted:
+                    return False
+                self.waiter = None
+            else:
+                token = self.token = object()
+                self.waiter = res.request(lambda: self.loop.schedule(self, token),
+                                          acquirer = self.fn.__name__,
+                                          priority = self.future.priority,
+                                          preempt = getattr(self.fn, "_preempt", False),
+                                          action = self.future)
+                if self.waiter is not None:
+                    return False
+            self.to_release.append(self.to_acquire.pop(0))
+        return True
+
+    def wait_for(self, awaited):
+        token = self.token = object()
+
+        if awaited is None:
+            self.loop.schedule(self, token)
+
+        elif isinstance(awaited, (int, float)):
+            self.loop.schedule_at(get_clock().time() + awaited, self, token)
+
+        elif isinstance(awaited, Future):
+            def on_done(future):
+                try:
+                    value = future.result(0)
+                except BaseException as e:
+                    self.loop.schedule(self, token, exc = e)
+                else:
+                    self.loop.schedule(self, token, value)
+            awaited.add_done_callback(on_done)
+
+        elif hasattr(awaited, "result"): # FakeFuture
+            self.loop.schedule(self, token, awaited.result())
+
+        else:
+            self.loop.schedule(self, token,
+                    exc = TypeError("Coroutine action <%s> yielded %r: expected a number, a future or None" % (self.future, awaited)))
+
+    def complete(self, result = None, exception = None):
+        for res in self.to_release:
+            res.release()
+        self.to_release = []
+
+        if exception is not None:
+            self.future.set_exception(exception)
+        else:
+            self.future.set_result(result)
+            logger.debug("Action <%s>: completed.", self.future)
+
+
+class CoroutineLoop(threading.Thread):
+    """ The loop thread executing the coroutine actions of an executor.
+    """
+
+    def __init__(self, executor):
+        threading.Thread.__init__(self, name = "Robot coroutine actions loop")
+        self.daemon = True
+
+        self.executor = executor
+
+        self.lock = threading.Lock()
+        self.wakeup = WakeupEvent()
+
+        self.ready = deque() # (task, token, value, exc)
+        self.timers = [] # heap of (time, seq, task, token)
+        self.seq = itertools.count() # tie-breaker for timers
+
+        self.running = True
+
+    def start_task(self, future, fn, args, kwargs):
+        # the task must be known to the future *before* it starts running,
+        # so that it can always be cancelled (cf CoroutineAction.interrupt)
+        future.task = CoroutineTask(self, future, fn, args, kwargs)
+        future.set_running_or_notify_cancel()
+        self.schedule(future.task, None)
+
+    def schedule(self, task, token, value = None, exc = None):
+        """ Resumes ``task`` as soon as possible. If ``token`` is None, the
+        task is resumed whatever it is currently waiting for.
+        """
+        with self.lock:
+            self.ready.append((task, token, value, exc))
+        self.wakeup.set()
+
+    def schedule_at(self, when, task, token):
+        with self.lock:
+            heapq.heappush(self.timers, (when, next(self.seq), task, token))
+        self.wakeup.set()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self is not threading.current_thread():
+            self.join()
+
+    def run(self):
+        clock = get_clock()
+        clock.enter(reserved = True) # cf RobotActionExecutor.submit_coroutine
+        try:
+            self.process_tasks(clock)
+        finally:
+            clock.exit()
+
+    def process_tasks(self, clock):
+        while self.running:
+
+            self.wakeup.clear()
+
+            now = clock.time()
+            with self.lock:
+                while self.timers and self.timers[0][0] <= now:
+                    when, seq, task, token = heapq.heappop(self.timers)
+                    self.ready.append((task, token, None, None))
+
+                ready, self.ready = self.ready, deque()
+                next_timer = self.timers[0][0] if self.timers else None
+
+            for task, token, value, exc in ready:
+                if token is not None and token is not task.token:
+                    continue # stale wake-up
+                task.step(value, exc)
+
+            if ready:
+                continue
+
+            if next_timer is None:
+                clock.wait(self.wakeup)
+            else:
+                clock.wait(self.wakeup, max(0, next_timer - clock.time()))
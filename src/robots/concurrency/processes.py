@@ -0,0 +1,251 @@
+# coding=utf-8
+"""
+Execution of CPU-heavy actions in a pool of processes.
+
+The body of actions declared with ``@action(process=True)`` is executed in
+a separate process, so that it does not hold the GIL of the process running
+the robot controller. The action still has its own thread in the main
+process: this thread acquires the resources locked by the action (they
+remain held for the whole duration of the action), sends the call to an
+idle worker process, and waits for the result. The action returns a
+regular :class:`.RobotAction`.
+
+Cancelling the action terminates the worker process (a new one is started
+when needed).
+
+Since the robot instance can not be shared with another process, the body
+of the action receives ``None`` instead of the robot:
+
+.. code-block:: python
+
+    @action(process=True)
+    def plan(robot, start, goal): # robot is None here!
+        ...
+        return path
+
+    path = robot.plan(start, goal).result()
+
+The action function must be defined at the top-level of a module.
+
+Arguments and results are serialized with the highest pickle protocol.
+NumPy arrays created with :func:`shared_array` are backed by shared memory:
+they are passed to the worker process *without copy* (the worker can also
+write into them).
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import os
+import sys
+import mmap
+import tempfile
+import threading
+import traceback
+import multiprocessing
+import cPickle as pickle
+
+import numpy
+
+from .concurrency import sleep, checkpoint, ACTIVE_SLEEP_RESOLUTION
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+class SharedArray(numpy.ndarray):
+    """ A NumPy array backed by shared memory, created with
+    :func:`shared_array`.
+
+    When pickled, a SharedArray is only serialized as a reference to its
+    shared memory segment. Views of a SharedArray that are not contiguous, or
+    do not start at the beginning of the segment, are serialized by copy,
+    like regular arrays.
+    """
+
+    def __array_finalize__(self, obj):
+        self._shm = getattr(obj, "_shm", None)
+
+    def __reduce__(self):
+        shm = self._shm
+        if shm is not None and \
+           self.__array_interface__["data"][0] == shm.address and \
+           self.flags["C_CONTIGUOUS"]:
+            return (_attach_shared_array, (shm.path, self.shape, self.dtype.str))
+
+        return numpy.ndarray.__reduce__(self.view(numpy.ndarray))
+
+class _SharedMemory(object):
+    """ A file-backed shared memory segment, deleted with its last array.
+    """
+    def __init__(self, size, path = None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix = "pyrobots-", dir = SHM_DIR)
+            os.ftruncate(fd, max(size, 1))
+            self.owner = True
+        else:
+            fd = os.open(path, os.O_RDWR)
+            self.owner = False
+
+        self.path = path
+        self.buffer = mmap.mmap(fd, max(size, 1))
+        os.close(fd)
+
+        self.address = None
+
+    def __del__(self):
+        if self.owner:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+def _array_on(shm, shape, dtype):
+    array = numpy.frombuffer(shm.buffer, dtype = dtype,
+                             count = int(numpy.prod(shape))).reshape(shape).view(SharedArray)
+    array._shm = shm
+    shm.address = array.__array_interface__["data"][0]
+    return array
+
+def shared_array(shape, dtype = float):
+    """ Creates a (zero-initialized) NumPy array in shared memory. Such an
+    array is passed to the process-based actions without copy.
+    """
+    dtype = numpy.dtype(dtype)
+    shm = _SharedMemory(int(numpy.prod(shape)) * dtype.itemsize)
+    return _array_on(shm, shape, dtype)
+
+def _attach_shared_array(path, shape, dtype):
+    dtype = numpy.dtype(dtype)
+    shm = _SharedMemory(int(numpy.prod(shape)) * dtype.itemsize, path)
+    return _array_on(shm, shape, dtype)
+
+
+def _worker_main(conn, parent_conn):
+    """ Main loop of the worker processes.
+    """
+    # we are forked from an action thread: get rid of its trace hook
+    sys.settrace(None)
+
+    # otherwise, we would never see the end of the connection
+    parent_conn.close()
+
+    while True:
+        try:
+            module, name, args, kwargs = pickle.loads(conn.recv_bytes())
+        except EOFError:
+            return
+
+        try:
+            __import__(module)
+            fn = getattr(sys.modules[module], name)
+            fn = getattr(fn, "_fn", fn) # the undecorated action
+
+            reply = (True, fn(None, *args, **kwargs))
+        except BaseException:
+            e = sys.exc_info()[1]
+            reply = (False, (e, traceback.format_exc()))
+
+        try:
+            payload = pickle.dumps(reply, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            e = sys.exc_info()[1]
+            payload = pickle.dumps((False, (RuntimeError("Unable to serialize the result: %s" % e), "")),
+                                   pickle.HIGHEST_PROTOCOL)
+        conn.send_bytes(payload)
+
+class ProcessWorker(object):
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target = _worker_main,
+                                               args = (child_conn, self.conn),
+                                               name = "pyRobots process worker")
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def terminate(self):
+        self.conn.close()
+        self.process.terminate()
+        self.process.join()
+
+    def close(self, timeout = 1):
+        self.conn.close()
+        # the pipe may also have been inherited by workers forked later on:
+        # do not wait forever for the worker to see its end.
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+class ProcessPool(object):
+    """ A bounded pool of worker processes, started on demand.
+    """
+    def __init__(self, size = None):
+        self.size = size or multiprocessing.cpu_count()
+
+        self.lock = threading.Lock()
+        self.idle = []
+        self.nb_workers = 0
+
+    def run(self, fn, args, kwargs):
+        """ Executes ``fn(None, *args, **kwargs)`` in a worker process, and
+        returns its result. Blocks until the result is available.
+
+        Cancellation signals are honoured while waiting for a worker and
+        while waiting for the result. In the later case, the worker
+        process is terminated.
+        """
+        payload = pickle.dumps((fn.__module__, fn.__name__, args, kwargs),
+                               pickle.HIGHEST_PROTOCOL)
+
+        worker = None
+        try:
+            worker = self.acquire_worker()
+            worker.conn.send_bytes(payload)
+            while not worker.conn.poll(ACTIVE_SLEEP_RESOLUTION):
+                checkpoint()
+            ok, result = pickle.loads(worker.conn.recv_bytes())
+        except BaseException:
+            if worker is not None:
+                logger.debug("Terminating worker process of action <%s>" % fn.__name__)
+                self.discard_worker(worker)
+            raise
+
+        self.release_worker(worker)
+
+        if not ok:
+            exception, tb = result
+            logger.error("Exception in process action <%s>:\n%s" % (fn.__name__, tb))
+            raise exception
+
+        return result
+
+    def acquire_worker(self):
+        while True:
+            with self.lock:
+                if self.idle:
+                    return self.idle.pop()
+                if self.nb_workers < self.size:
+                    self.nb_workers += 1
+                    break
+            sleep(ACTIVE_SLEEP_RESOLUTION)
+
+        try:
+            return ProcessWorker()
+        except BaseException:
+            with self.lock:
+                self.nb_workers -= 1
+            raise
+
+    def release_worker(self, worker):
+        with self.lock:
+            self.idle.append(worker)
+
+    def discard_worker(self, worker):
+        worker.terminate()
+        with self.lock:
+            self.nb_workers -= 1
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+            self.nb_workers -= len(idle)
+        for worker in idle:
+            worker.close()
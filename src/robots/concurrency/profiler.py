@@ -0,0 +1,160 @@
+# coding=utf-8
+"""
+Sampling profiler of the robot actions.
+
+A background thread periodically samples the stacks of the threads
+currently executing actions (cf ``actions_by_thread`` in
+:class:`.RobotActionExecutor`), and counts them per action name. The
+overhead only depends on the sampling rate and on the number of running
+actions, not on the code of the actions (unlike a deterministic profiler
+like ``cProfile``).
+
+The samples are exported as *collapsed stacks* (one ``frame;frame;... count``
+line per distinct stack, the root frame being the name of the action), the
+input format of flame graph tools (``flamegraph.pl``, speedscope...).
+
+.. code-block:: python
+
+    with robot.profiling(rate = 200) as profiler:
+        robot.goto(kitchen).wait()
+
+    profiler.dump("goto.folded")
+    # $ flamegraph.pl goto.folded > goto.svg
+"""
+import logging; logger = logging.getLogger("robots.profiler")
+
+import sys
+import time
+import os.path
+import threading
+
+DEFAULT_RATE = 100 # Hz
+MAX_DEPTH = 64 # frames: deeper stacks are truncated (on the root side)
+
+# frames of these modules (threads bootstrap) are not reported
+_SKIPPED_MODULES = ("threading.py",)
+
+class SamplingProfiler(threading.Thread):
+    """ Samples the stacks of the running actions of ``executor``, ``rate``
+    times per second. Started and stopped by
+    :meth:`.RobotActionExecutor.start_profiler`/:meth:`~.RobotActionExecutor.stop_profiler`.
+    """
+
+    def __init__(self, executor, rate = DEFAULT_RATE, max_depth = MAX_DEPTH):
+        threading.Thread.__init__(self, name = "Robot actions profiler")
+        self.daemon = True
+
+        if rate <= 0:
+            raise ValueError("The sampling rate must be positive (got %s)" % rate)
+
+        self.executor = executor
+        self.interval = 1. / rate
+        self.max_depth = max_depth
+
+        self.lock = threading.Lock()
+        self.stacks = {} # collapsed stack -> number of samples
+        self.samples = {} # action name -> number of samples
+        self.labels = {} # code object -> frame label ('' if skipped)
+
+        self.nb_ticks = 0
+        self.busy = 0. # time spent sampling
+        self.start_time = None
+        self.stop_time = None
+
+        self.running = True
+        # set by stop(): interrupts the wait for the next tick (wall-clock
+        # time, whatever the robot's clock)
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.running = False
+        self.stopped.set()
+        if self is not threading.current_thread():
+            self.join()
+
+    def run(self):
+        self.start_time = time.time()
+        next_tick = self.start_time
+        while self.running:
+            start = time.time()
+            self.sample()
+            end = time.time()
+            self.busy += end - start
+            self.nb_ticks += 1
+
+            # fixed rate, but no catching up after a long sample
+            next_tick = max(next_tick + self.interval, end)
+            self.stopped.wait(next_tick - end)
+
+        self.stop_time = time.time()
+
+    def _label(self, code):
+        filename = os.path.basename(code.co_filename)
+        if filename in _SKIPPED_MODULES:
+            return ""
+        return "%s (%s)" % (code.co_name, filename)
+
+    def sample(self):
+        """ Records the current stack of every running action.
+        """
+        frames = sys._current_frames()
+        frame = None
+        labels = self.labels
+
+        samples = []
+        for ident, action in self.executor.actions_by_thread.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+
+            stack = []
+            depth = 0
+            while frame is not None and depth < self.max_depth:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = self._label(code)
+                if label:
+                    stack.append(label)
+                frame = frame.f_back
+                depth += 1
+
+            name = action._name[0]
+            stack.append(name)
+            stack.reverse()
+            samples.append((name, ";".join(stack)))
+
+        del frames, frame # do not keep the frames of the actions alive
+
+        with self.lock:
+            for name, stack in samples:
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.samples[name] = self.samples.get(name, 0) + 1
+
+    def collapsed(self):
+        """ Returns the samples as collapsed stacks: one ``frame;frame;...
+        count`` line per distinct stack, the first frame being the name of
+        the action.
+        """
+        with self.lock:
+            return "".join("%s %d\n" % (stack, count) for stack, count in sorted(self.stacks.items()))
+
+    def dump(self, filename):
+        """ Writes the collapsed stacks (cf :meth:`collapsed`) to ``filename``.
+        """
+        with open(filename, "w") as output:
+            output.write(self.collapsed())
+
+    def stats(self):
+        """ Returns a summary of the profile, as a dictionary:
+
+        - ``ticks``: number of sampling rounds,
+        - ``actions``: ``{<action name>: <number of samples>}``,
+        - ``overhead``: fraction of the profiling time spent sampling.
+        """
+        end = self.stop_time or time.time()
+        elapsed = end - self.start_time if self.start_time else 0.
+        with self.lock:
+            return {"ticks": self.nb_ticks,
+                    "actions": dict(self.samples),
+                    "overhead": self.busy / elapsed if elapsed else 0.}
@@ -2,4 +2,9 @@
 class ActionCancelled(UserWarning): pass
 class ActionPaused(UserWarning): pass
 
-
+class ActionRejected(RuntimeError):
+    """ Raised when submitting an action while the robot already runs its
+    maximum number of actions (cf the ``admission`` policy of
+    :class:`robots.concurrency.concurrency.RobotActionExecutor`).
+    """
+    pass
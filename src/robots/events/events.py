@@ -9,6 +9,8 @@ import weakref
 
 import threading # for current_thread()
 from robots.concurrency import SignalingThread, ACTIVE_SLEEP_RESOLUTION
+from robots.concurrency import sleep, checkpoint
+from robots.concurrency.clock import get_clock
 
 from robots.introspection import introspection
 
@@ -208,15 +210,25 @@ class EventMonitor:
         # first add callback? start a thread to monitor the event!
         if not self.thread:
             self.monitoring = True
-            self.thread = SignalingThread(target=self._monitor)
-            self.thread.start()
+            self.thread = SignalingThread(target=self._monitor,
+                                          backend = self.robot.executor.cancellation)
+            get_clock().reserve() # the monitor participates in the clock, cf _monitor
+            self.robot.executor.start_thread(self.thread)
 
         self.cbs.append(cb)
         return self # to allow for chaining
 
     def _monitor(self):
+        clock = get_clock()
+        clock.enter(reserved = True)
+        try:
+            self._process_events()
+        finally:
+            clock.exit()
 
-        threading.current_thread().name = "Event monitor on %s" % self
+    def _process_events(self):
+
+        threading.current_thread().set_status("Event monitor on %s", self)
         while self.monitoring:
             ok = self._wait_for_condition()
             if not ok: # monitoring has been interrupted!
@@ -291,7 +303,7 @@ class EventMonitor:
                     logger.info("<%s> not monitored anymore" % str(self))
                     return False
                 while not self.var(self.robot):
-                    time.sleep(ACTIVE_SLEEP_RESOLUTION)
+                    sleep(ACTIVE_SLEEP_RESOLUTION)
 
             # state-based event
             else:
@@ -300,17 +312,19 @@ class EventMonitor:
                     logger.warning("Waiting for %s to be published by the robot..." % self.var)
                     while not self.var in self.robot.state:
                         self.robot.wait_for_state_update(2)
+                        checkpoint()
 
                 while not self._check_condition(self.robot.state[self.var]):
                     if not self.monitoring:
                         logger.info("<%s> not monitored anymore" % str(self))
                         return False
                     self.robot.wait_for_state_update(ACTIVE_SLEEP_RESOLUTION)
+                    checkpoint()
 
         else:
             #dummy mode. Wait a little bit, and assume the condition is true
 
-            time.sleep(0.2)
+            sleep(0.2)
         logger.info("%s is true" % str(self) + (" (dummy mode)" if self.robot.dummy else ""))
         return True
 
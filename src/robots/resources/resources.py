@@ -1,12 +1,91 @@
 # coding=utf-8
-from threading import Lock
+"""
+Resources (wheels, arms, head...) that actions can lock (cf :func:`.lock`).
+
+Contended resources are granted by *priority* (cf the ``priority`` option of
+:func:`~robots.concurrency.action.action`): when a resource is released, it
+is directly handed over to the waiting action with the highest priority
+(first come, first served among actions of the same priority).
+"""
+import logging; logger = logging.getLogger("robots.resources")
+
 import time
+import heapq
+import itertools
+from threading import Lock, current_thread
+
+from robots.concurrency import SignalingThread
+from robots.concurrency.clock import WakeupEvent, get_clock
+
+# priority -> [number of acquisitions, total wait time, max wait time]
+_wait_stats = {}
+_wait_stats_lock = Lock()
+
+def _record_wait(priority, duration):
+    with _wait_stats_lock:
+        stats = _wait_stats.setdefault(priority, [0, 0., 0.])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+
+def wait_stats():
+    """ Returns, for each action priority, statistics on the time spent by
+    actions waiting for their resources, as a dictionary ``{priority: {"count":
+    <number of acquisitions>, "mean": <mean wait, in sec>, "max": <max wait, in sec>}}``.
+
+    Only the acquisitions that may wait (``@lock(res, wait=True)``, the
+    default) are accounted for.
+    """
+    with _wait_stats_lock:
+        return dict((priority, {"count": count, "mean": total / count, "max": longest})
+                    for priority, (count, total, longest) in _wait_stats.items())
+
+def reset_wait_stats():
+    with _wait_stats_lock:
+        _wait_stats.clear()
+
+
+class _Waiter:
+    def __init__(self, acquirer, priority, action, on_granted = None):
+        self.acquirer = acquirer
+        self.priority = priority
+        self.action = action
+        self.on_granted = on_granted # cf Resource.request
+        self.start = time.time()
+
+        thread = current_thread()
+        if on_granted is not None:
+            self.thread = None
+            self.event = None
+        elif isinstance(thread, SignalingThread):
+            # the thread's wakeup event is also set when the thread is
+            # signaled: cancelling the action interrupts the wait.
+            self.thread = thread
+            self.event = thread.wakeup
+        else:
+            self.thread = None
+            self.event = WakeupEvent()
+
+        self.granted = False
+        self.abandoned = False
 
 class Resource:
     def __init__(self, name = ""):
-        self.lock = Lock()
         self.name = name
-        self.owner = None
+
+        # protects the owner and the queue of waiters
+        self.lock = Lock()
+
+        self.locked = False
+        self.owner = None # name of the owner
+        self.owner_action = None # action (future) owning the resource, if known
+        self.owner_priority = 0
+
+        self.waiters = [] # heap of (-priority, seq, waiter)
+        self.seq = itertools.count() # FIFO order among equal priorities
+
+        # owners that temporarily transfered the resource (cf __enter__)
+        self.transfers = []
 
     def __str__(self):
         return self.name + ((" (currently owned by <%s>)" % self.owner) if self.owner else " (not currently owned)")
@@ -19,7 +98,7 @@ class Resource:
         lock ownership to a sub-action:
 
         For instance:
-        
+
         .. code-block::python
 
             @action
@@ -38,32 +117,161 @@ class Resource:
         ``WHEELS``, executing ``move()`` and reacquiring the lock, also if
         ``move()`` raises an exception.
         """
+        self.transfers.append((self.owner, self.owner_priority, self.owner_action))
         self.release()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.acquire()
+        owner, priority, action = self.transfers.pop()
+        self.acquire(acquirer = owner, priority = priority, action = action)
         # here, the exception, if any, is automatically propagated
 
-    def acquire(self, wait = True, acquirer = "unknown"):
+    def acquire(self, wait = True, acquirer = "unknown", priority = 0, preempt = False, action = None):
+        """ Acquires the resource.
 
-        if not wait:
-            if self.lock.acquire(False):
-                self.owner = acquirer
+        :param wait: (default: True) if ``False``, returns ``False``
+          immediately if the resource is not available.
+        :param acquirer: name of the new owner
+        :param priority: (default: 0) priority of the acquirer. Waiting
+          acquirers with higher priorities are served first.
+        :param preempt: (default: False) if ``True``, and the resource is
+          owned by an action of lower priority, this action is cancelled.
+        :param action: the action (future) acquiring the resource, if any.
+          Required for this action to be preempted later on.
+        """
+        with self.lock:
+            if not self.locked:
+                # (the remaining waiters, if any, have all been abandoned)
+                self.waiters = []
+                self.locked = True
+                self._set_owner(acquirer, priority, action)
+                if wait:
+                    _record_wait(priority, 0.)
                 return True
-            else:
-                return False
-        else:
-            # we need an active wait to make sure we can properly cancel the actions
-            # that are waiting for the resource
-            while True:
-                if self.lock.acquire(False):
-                    self.owner = acquirer
-                    return True
-                time.sleep(0.1)
+
+            owner_action, owner_priority = self.owner_action, self.owner_priority
+
+            if wait:
+                waiter = _Waiter(acquirer, priority, action)
+                heapq.heappush(self.waiters, (-priority, next(self.seq), waiter))
+
+        if preempt:
+            self._preempt(owner_action, owner_priority, priority, action)
+
+        if not wait:
+            return False
+
+        start = time.time()
+        self._wait(waiter)
+        _record_wait(priority, time.time() - start)
+        return True
+
+    def request(self, on_granted, acquirer = "unknown", priority = 0, preempt = False, action = None):
+        """ Acquires the resource without blocking, for the callers that can
+        not wait (like the coroutine actions, cf
+        :mod:`robots.concurrency.coroutines`).
+
+        If the resource is available, acquires it and returns ``None``.
+        Otherwise, queues the request with the other waiters (cf
+        :meth:`acquire` for the other parameters), and returns the waiter:
+        once the resource is handed over to it, ``on_granted()`` is called
+        from the releasing thread. Pass the waiter to :meth:`abandon` to
+        stop waiting.
+        """
+        with self.lock:
+            if not self.locked:
+                self.waiters = []
+                self.locked = True
+                self._set_owner(acquirer, priority, action)
+                _record_wait(priority, 0.)
+                return None
+
+            owner_action, owner_priority = self.owner_action, self.owner_priority
+
+            waiter = _Waiter(acquirer, priority, action, on_granted)
+            heapq.heappush(self.waiters, (-priority, next(self.seq), waiter))
+
+        if preempt:
+            self._preempt(owner_action, owner_priority, priority, action)
+
+        return waiter
+
+    def abandon(self, waiter):
+        """ Withdraws a request queued by :meth:`request`. If the resource
+        has already been handed over to it, it is released.
+        """
+        with self.lock:
+            granted = waiter.granted
+            waiter.abandoned = True
+        if granted:
+            self.release()
+
+    def _preempt(self, owner_action, owner_priority, priority, action):
+        if owner_action is None or owner_priority >= priority or owner_action.done():
+            return
+
+        if action is not None and action.childof(owner_action):
+            # we would cancel our own parent
+            return
+
+        logger.info("Preempting resource %s: cancelling <%s> (priority %s) for <%s> (priority %s)",
+                    self.name, owner_action, owner_priority, action, priority)
+        owner_action.signal_cancel()
+
+    def _wait(self, waiter):
+        """ Blocks until the resource is handed over to ``waiter`` (cf
+        :meth:`release`). If the waiting action is cancelled, the waiter is
+        removed from the queue and :class:`.ActionCancelled` is raised.
+        """
+        thread = waiter.thread
+        clock = get_clock()
+        try:
+            if thread is None:
+                clock.wait(waiter.event)
+                return
+
+            with thread.shielded():
+                while True:
+                    # clear *before* checking, so that a hand-over happening
+                    # in-between is not missed
+                    waiter.event.clear()
+                    if waiter.granted:
+                        return
+                    thread.checkpoint()
+                    clock.wait(waiter.event)
+        except BaseException:
+            # if handed over while we were being cancelled, passes it on
+            self.abandon(waiter)
+            raise
+
+    def _set_owner(self, acquirer, priority, action):
+        self.owner = acquirer
+        self.owner_priority = priority
+        self.owner_action = action
 
     def release(self):
-        self.lock.release()
-        self.owner = None
+        """ Releases the resource, and directly hands it over to the waiting
+        acquirer with the highest priority, if any.
+        """
+        with self.lock:
+            while self.waiters:
+                _, _, waiter = heapq.heappop(self.waiters)
+                if waiter.abandoned:
+                    continue
+
+                self._set_owner(waiter.acquirer, waiter.priority, waiter.action)
+                waiter.granted = True
+                if waiter.on_granted is None:
+                    waiter.event.set()
+                    return
+                break
+            else:
+                self.locked = False
+                self._set_owner(None, 0, None)
+                return
+
+        # (outside of the lock: the callback may well use the resource)
+        _record_wait(waiter.priority, time.time() - waiter.start)
+        waiter.on_granted()
 
 
 class CompoundResource:
@@ -71,6 +279,10 @@ class CompoundResource:
         self.resources = args
         self.name = kwargs.get("name", "")
         self.owner = None
+        self.owner_priority = 0
+        self.owner_action = None
+
+        self.transfers = []
 
     def __str__(self):
         return self.name + ((" (currently owned by <%s>)" % self.owner) if self.owner else " (not currently owned)")
@@ -79,28 +291,44 @@ class CompoundResource:
     def __enter__(self):
         """ cf doc of Resource.__enter__.
         """
+        self.transfers.append((self.owner, self.owner_priority, self.owner_action))
         self.release()
 
     def __exit__(self, exc_type, exc_value, traceback):
         """ cf doc of Resource.__exit__.
         """
-        self.acquire()
+        owner, priority, action = self.transfers.pop()
+        self.acquire(acquirer = owner, priority = priority, action = action)
         # here, the exception, if any, is automatically propagated
 
 
 
-    def acquire(self, wait = True, acquirer = "unknown"):
-        ok = True
-        for res in self.resources:
-            ok = res.acquire(wait, acquirer) and ok
+    def acquire(self, wait = True, acquirer = "unknown", priority = 0, preempt = False, action = None):
+        """ cf doc of Resource.acquire.
+        """
+        acquired = []
+        try:
+            for res in self.resources:
+                if not res.acquire(wait, acquirer, priority, preempt, action):
+                    break
+                acquired.append(res)
+        finally:
+            if len(acquired) != len(self.resources):
+                # release what we have already acquired: all or nothing
+                for r in acquired:
+                    r.release()
 
-        if not ok:
+        if len(acquired) != len(self.resources):
             return False
 
         self.owner = acquirer
+        self.owner_priority = priority
+        self.owner_action = action
+        return True
 
     def release(self):
         for res in self.resources:
             res.release()
         self.owner = None
-
+        self.owner_priority = 0
+        self.owner_action = None
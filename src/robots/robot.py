@@ -6,13 +6,17 @@ if (hasattr(logging, "NullHandler")): # python >= 2.7
 import time
 import pkgutil, sys
 from functools import partial
+from contextlib import contextmanager
 
 from robots.helpers.misc import valuefilter
 from robots.poses import PoseManager
 from robots.introspection import introspection
 from robots.events import Events
 from robots.mw import * # ROS, NAOQI...
-from robots.concurrency import RobotActionExecutor, ACTIVE_SLEEP_RESOLUTION
+from robots.concurrency import RobotActionExecutor, SignalingThread, ACTIVE_SLEEP_RESOLUTION, MAX_TIME_TO_COMPLETE
+from robots.concurrency import sleep, wait_all, wait_any, as_completed
+
+from concurrent.futures import TimeoutError
 
 
 class State(dict):
@@ -111,6 +115,9 @@ class GenericRobot(object):
     
         - :meth:`running`: prints the list of running tasks (with their IDs)
         - :meth:`actioninfo`: give details on a given action, including the exact line being currently executed
+        - :meth:`action_stats`: timing statistics (queueing, waiting for resources, execution, cancellation) of the completed actions
+        - :meth:`thread_stats`: number of threads owned by the robot, and their memory cost
+        - :meth:`profiling`: sampling profiler of the running actions, exported as flame graphs
     
     """
 
@@ -119,6 +126,12 @@ class GenericRobot(object):
                  supports = 0, 
                  dummy = False, 
                  immediate = False,
+                 pool_size = None,
+                 cancellation = SignalingThread.TRACE,
+                 max_actions = None,
+                 admission = RobotActionExecutor.REJECT,
+                 max_queued = 100,
+                 stack_size = None,
                  configure_logging = True):
         """
         :param list actions: a list of packages that contains modules with
@@ -136,6 +149,26 @@ class GenericRobot(object):
         :param boolean immediate: if ``True`` (defaults to ``False``), actions are
           executed in the main thread instead of their own separate threads.
           Useful for some specific debugging scenarios.
+        :param int pool_size: (default: None) if set, actions are executed by a
+          pool of ``pool_size`` pre-started threads instead of one new thread
+          per action. Cf :class:`.RobotActionExecutor`.
+        :param cancellation: (default: ``SignalingThread.TRACE``) how
+          cancellation signals are delivered to the actions and event
+          monitors. Cf :class:`.SignalingThread` for the available backends.
+        :param int max_actions: (default: None, ie ``MAX_FUTURES``) maximum
+          number of actions executed in parallel by this robot.
+        :param admission: (default: ``RobotActionExecutor.REJECT``) what to
+          do with new actions once ``max_actions`` are running: reject them
+          (:class:`.ActionRejected`), queue them (``RobotActionExecutor.QUEUE``)
+          or queue them, dropping the oldest queued action when the queue is
+          full (``RobotActionExecutor.DROP_OLDEST``). Cf
+          :class:`.RobotActionExecutor`.
+        :param int max_queued: (default: 100) maximum number of actions waiting
+          for admission.
+        :param int stack_size: (default: None, ie system default) stack size
+          (in bytes) of the action and event monitor threads. Reducing it
+          (eg, to 256KB) reduces the memory footprint of robots running many
+          concurrent actions. Cf :meth:`thread_stats`.
         :param boolean configure_logging: if ``True`` (default), configures
           a default colorized console logging handler.
         """
@@ -156,7 +189,12 @@ class GenericRobot(object):
         # direct member accessors). Users are expected to override this member
         self.state = State()
 
-        self.executor = RobotActionExecutor()
+        self.executor = RobotActionExecutor(pool_size = pool_size,
+                                            cancellation = cancellation,
+                                            max_actions = max_actions,
+                                            admission = admission,
+                                            max_queued = max_queued,
+                                            stack_size = stack_size)
 
 
         self.immediate = immediate
@@ -222,7 +260,7 @@ class GenericRobot(object):
     def running(self):
         """ Print the list of running actions.
         """
-        logger.info(str(self.executor))
+        logger.info("%s", self.executor)
 
     def actioninfo(self, id):
         """ Print details on a running action (including the current line
@@ -230,6 +268,52 @@ class GenericRobot(object):
         """
         logger.info(self.executor.actioninfo(id))
 
+    def action_stats(self, name = None):
+        """ Returns histograms of the time spent by the completed actions in
+        each phase of their lifecycle (queued, waiting for resources,
+        running, being cancelled), per action name.
+
+        Cf :meth:`.RobotActionExecutor.lifecycle_stats` for details.
+
+        .. code-block:: python
+
+            stats = robot.action_stats("goto")
+            print("resource wait: p90=%ss" % stats["resource wait"]["p90"])
+
+        :param name: (default: None) if set, only returns the statistics of
+          this action.
+        """
+        return self.executor.lifecycle_stats(name)
+
+    def thread_stats(self):
+        """ Returns the number of threads owned by the robot (actions, event
+        monitors...) and their approximate memory cost.
+
+        Cf :meth:`.RobotActionExecutor.thread_stats` for details.
+        """
+        return self.executor.thread_stats()
+
+    @contextmanager
+    def profiling(self, rate = None):
+        """ Context manager that samples the stacks of the running actions,
+        ``rate`` times per second, while the ``with`` block executes.
+
+        .. code-block:: python
+
+            with robot.profiling(rate = 200) as profiler:
+                robot.goto(kitchen).wait()
+
+            profiler.dump("goto.folded") # collapsed stacks, for flamegraph.pl
+            print(profiler.stats())
+
+        Cf :mod:`robots.concurrency.profiler`.
+        """
+        profiler = self.executor.start_profiler(rate)
+        try:
+            yield profiler
+        finally:
+            self.executor.stop_profiler()
+
     @staticmethod
     def configure_console_logging():
         from robots.helpers.ansistrm import ConcurrentColorizingStreamHandler
@@ -262,7 +346,7 @@ class GenericRobot(object):
         The default implementation simply waits ``ACTIVE_SLEEP_RESOLUTION``
         seconds.
         """
-        time.sleep(ACTIVE_SLEEP_RESOLUTION)
+        sleep(ACTIVE_SLEEP_RESOLUTION)
 
     def __enter__(self):
         return self
@@ -273,6 +357,7 @@ class GenericRobot(object):
     def close(self):
         self.cancel_all()
         self.events.close()
+        self.executor.shutdown()
 
         if self.supports(ROS):
             import rospy
@@ -281,16 +366,11 @@ class GenericRobot(object):
 
     @staticmethod
     def sleep(duration):
-        """ Active sleep. Must used by actions to make sure they can be quickly
-        cancelled.
+        """ Cancellable sleep. Must used by actions to make sure they can be quickly
+        cancelled: the sleep is interrupted as soon as the action is
+        cancelled, whatever the cancellation backend.
         """
-
-        tot_time = 0
-        while tot_time // duration == 0:
-            time.sleep(ACTIVE_SLEEP_RESOLUTION)
-            tot_time += ACTIVE_SLEEP_RESOLUTION
-
-        time.sleep(duration % ACTIVE_SLEEP_RESOLUTION)
+        sleep(duration)
 
     def wait(self, var, **kwargs):
         """ Alias to wait on a given condition. Cf :class:`robots.events.Events`
@@ -298,6 +378,74 @@ class GenericRobot(object):
         """
         self.on(var, **kwargs).wait()
 
+    def wait_all(self, *actions, **kwargs):
+        """ Waits for all the given actions to complete, and returns the list
+        of their results.
+
+        .. code-block:: python
+
+            left, right = robot.wait_all(robot.look_left(), robot.look_right())
+
+        :param timeout: (default: None) if set, maximum time (in seconds) to
+          wait for. Raises :class:`concurrent.futures.TimeoutError` if some
+          actions are still running after that.
+
+        When called from an action, the wait is interrupted as soon as this
+        action is cancelled.
+        """
+        if not wait_all(actions, kwargs.get("timeout")):
+            raise TimeoutError()
+        return [a.result() for a in actions]
+
+    def wait_any(self, *actions, **kwargs):
+        """ Waits for the first of the given actions to complete, and returns
+        it.
+
+        :param timeout: (default: None) if set, maximum time (in seconds) to
+          wait for. Raises :class:`concurrent.futures.TimeoutError` if all
+          the actions are still running after that.
+        """
+        first = wait_any(actions, kwargs.get("timeout"))
+        if first is None:
+            raise TimeoutError()
+        return first
+
+    def as_completed(self, *actions, **kwargs):
+        """ Iterates over the given actions as they complete.
+
+        .. code-block:: python
+
+            for action in robot.as_completed(*searches):
+                if action.result():
+                    robot.cancel_all_others()
+                    break
+
+        :param timeout: (default: None) if set, maximum time (in seconds) to
+          wait for. Raises :class:`concurrent.futures.TimeoutError` if some
+          actions are still running after that.
+        """
+        return as_completed(actions, kwargs.get("timeout"))
+
+    def scope(self, timeout = MAX_TIME_TO_COMPLETE):
+        """ Returns a context manager that owns all the actions started
+        within the ``with`` block (by the calling thread, and their
+        sub-actions). When the block is left, normally or because of an
+        exception, the actions still running are cancelled, and given
+        together ``timeout`` seconds to stop.
+
+        .. code-block:: python
+
+            with robot.scope() as scope:
+                robot.look_at("person")
+                robot.goto(kitchen).wait()
+            # here, look_at is done (completed or cancelled)
+
+        Scopes can be nested: actions are owned by the innermost one.
+        The actions that ignored the cancellation are listed in
+        ``scope.stuck``. Cf :class:`~robots.concurrency.concurrency.ActionScope`.
+        """
+        return self.executor.scope(timeout)
+
     def cancel_all(self):
         """ Sends a 'cancel' signal (ie, the
         :class:`.ActionCancelled` exception is raised) to all
@@ -310,8 +458,14 @@ class GenericRobot(object):
         Actions that are not yet started (eg, actions waiting on a resource
         availability) are simply removed for the run queue.
 
+        All the actions are signaled at once, and then given together
+        :data:`~robots.concurrency.concurrency.MAX_TIME_TO_COMPLETE` seconds
+        to stop.
+
+        :returns: the list of actions that ignored the cancellation (ie, still
+          running after this delay).
         """
-        self.executor.cancel_all()
+        return self.executor.cancel_all()
 
     def cancel_all_others(self):
         """ Sends a 'cancel' signal (ie, the
@@ -323,8 +477,10 @@ class GenericRobot(object):
         Actions that are not yet started (eg, actions waiting on a resource
         availability) are simply removed for the run queue.
 
+        :returns: the list of actions that ignored the cancellation (cf
+          :meth:`cancel_all`).
         """
-        self.executor.cancel_all_others()
+        return self.executor.cancel_all_others()
 
 
     def filtered(self, name, val):
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Micro-benchmarks of pyRobots' action machinery.
+
+Runs without any middleware, using a dummy robot. Usage::
+
+    $ python benchmarks.py [--json results.json] [benchmark name...]
+
+With ``--json``, the results are also written to the given file (along
+with the Python version and the date), to compare them across revisions.
+
+"""
+
+import sys
+import time
+import json
+import traceback
+import logging
+import platform
+import threading
+import cProfile
+
+from concurrent.futures import Future
+
+import robots
+from robots.concurrency import action, wait, SignalingThread
+from robots.resources import Resource, lock
+import robots.concurrency.concurrency
+
+BENCH_RES = Resource("benchmark resource")
+
+@action
+def wait_for(robot, event):
+    while not event.is_set():
+        robot.sleep(0.05)
+
+@action
+def wait_future(robot, future):
+    """ Waits for the completion of ``future``, without polling.
+    """
+    wait(future)
+
+@action
+def noop(robot):
+    pass
+
+def _crunch(n):
+    start = time.time()
+    total = 0
+    for i in range(n):
+        total += i * i % 7
+    return time.time() - start
+
+@action
+def crunch(robot, n):
+    """ CPU-bound action: returns the time taken to perform n iterations
+    of a pure Python computation.
+    """
+    return _crunch(n)
+
+@action
+def crunch_cprofile(robot, n):
+    """ Same as crunch, under cProfile.
+    """
+    return cProfile.Profile().runcall(_crunch, n)
+
+@action
+def crunch_until(robot, event):
+    while not event.is_set():
+        sum(i * i for i in range(100))
+
+@action
+def spawn(robot, n):
+    """ Submits n sub-actions, and returns the average time spent in
+    submitting one of them (in seconds).
+    """
+    start = time.time()
+    for i in range(n):
+        robot.noop()
+    return (time.time() - start) / n
+
+@action
+def lookup(robot, n):
+    """ Returns the average time taken by n lookups of the current action
+    (in seconds).
+    """
+    executor = robot.executor
+    start = time.time()
+    for i in range(n):
+        executor.get_current_action()
+    return (time.time() - start) / n
+
+@action
+@lock(BENCH_RES)
+def hold(robot, future):
+    wait(future)
+
+@action
+@lock(BENCH_RES)
+def locked_noop(robot):
+    pass
+
+@action
+def nest(robot, depth, future):
+    """ Chain of ``depth`` nested sub-actions, the innermost one waiting
+    for ``future``.
+    """
+    if depth == 0:
+        wait(future)
+    else:
+        robot.nest(depth - 1, future).wait()
+
+@action
+def stamp(robot, stamps):
+    stamps.append(time.time())
+
+@action(inline = True)
+def inline_noop(robot):
+    pass
+
+class BenchRobot(robots.GenericRobot):
+
+    def __init__(self, dummy = True, **kwargs):
+        super(BenchRobot, self).__init__(actions=[wait_for, wait_future, noop, crunch, crunch_until, spawn, lookup,
+                                                  hold, locked_noop, nest, stamp, inline_noop,
+                                                  crunch_cprofile],
+                                         dummy = dummy,
+                                         configure_logging = False,
+                                         **kwargs)
+        self.loglevel(logging.WARNING)
+
+class NotifyingBenchRobot(BenchRobot):
+    """ Non-dummy robot whose state updates are notified to the event
+    monitors (instead of the default polling of wait_for_state_update).
+    """
+    def __init__(self, **kwargs):
+        super(NotifyingBenchRobot, self).__init__(dummy = False, **kwargs)
+        self.loglevel(logging.WARNING)
+        self.state_updated = threading.Condition()
+
+    def update_state(self, key, value):
+        with self.state_updated:
+            self.state[key] = value
+            self.state_updated.notify_all()
+
+    def wait_for_state_update(self, timeout = None):
+        with self.state_updated:
+            self.state_updated.wait(timeout)
+
+
+def _summary(latencies):
+    """ Median, 90th percentile and max of a list of durations.
+    """
+    latencies = sorted(latencies)
+    return {"median": latencies[len(latencies) // 2],
+            "p90": latencies[int(len(latencies) * 0.9)],
+            "max": latencies[-1]}
+
+def _ms(summary):
+    return "median %.2fms, p90 %.2fms, max %.2fms" % \
+            (summary["median"] * 1e3, summary["p90"] * 1e3, summary["max"] * 1e3)
+
+
+def nested_submit(live_actions = (10, 100, 1000), n = 200):
+    """ Cost of submitting a sub-action from within an action, depending on
+    the number of other actions currently running.
+    """
+    results = {}
+
+    # we deliberately run more actions than the default limit
+    with BenchRobot(max_actions = max(live_actions) + n + 10) as robot:
+        for nb in live_actions:
+            release = Future()
+            running = [robot.wait_future(release) for i in range(nb)]
+
+            lookup_time = robot.lookup(n).result()
+            submit_time = robot.spawn(n).result()
+
+            release.set_result(None)
+            for a in running:
+                a.wait()
+
+            results[nb] = {"lookup": lookup_time, "submit": submit_time}
+            print("%5d live actions: current action lookup: %.2fus, nested submit: %.2fus" % \
+                    (nb, lookup_time * 1e6, submit_time * 1e6))
+
+    return results
+
+def startup_latency(n = 500, pool_size = 8):
+    """ Time between the submission of an action and the beginning of its
+    execution by its thread, and time spent in the submit call itself, with
+    one thread per action and with a pool of threads.
+    """
+    results = {}
+
+    for mode, kwargs in [("thread per action", {}), ("pooled", {"pool_size": pool_size})]:
+        with BenchRobot(**kwargs) as robot:
+            latencies = []
+            submit_time = 0.
+            for i in range(n):
+                start = time.time()
+                a = robot.noop()
+                submit_time += time.time() - start
+                a.wait()
+                latencies.append(a.startup_latency())
+
+            latencies.sort()
+            results[mode] = {"submit": submit_time / n,
+                             "median": latencies[n // 2],
+                             "p99": latencies[int(n * 0.99)]}
+            print("%s: submit call: %.1fus, submit to start: median %.1fus, 99th percentile %.1fus" % \
+                    (mode, submit_time / n * 1e6, latencies[n // 2] * 1e6, latencies[int(n * 0.99)] * 1e6))
+
+    return results
+
+def cancellation_backends(n = 1000000, repeats = 20):
+    """ For each cancellation backend: throughput of a CPU-bound action, and
+    latency of the cancellation of a sleeping action and of a CPU-bound
+    action (time between cancel() and the completion of the action).
+    """
+    results = {}
+
+    for backend in [SignalingThread.TRACE, SignalingThread.ASYNC, SignalingThread.COOPERATIVE]:
+        with BenchRobot(cancellation = backend) as robot:
+            duration = robot.crunch(n).result()
+
+            latencies = {}
+            for name, fn in [("sleeping", robot.wait_for),
+                             ("cpu-bound", robot.crunch_until)]:
+                latencies[name] = []
+                for i in range(repeats):
+                    stop = threading.Event()
+                    a = fn(stop)
+                    time.sleep(0.02)
+                    thread = a.thread()
+                    start = time.time()
+                    thread.cancel()
+                    if not wait(a, 1):
+                        latencies[name] = None # not cancellable
+                        stop.set()
+                        a.wait()
+                        break
+                    latencies[name].append(time.time() - start)
+
+                if latencies[name]:
+                    latencies[name] = sorted(latencies[name])[repeats // 2]
+
+            results[backend] = {"throughput": n / duration, "cancel": latencies}
+            print("%11s: CPU-bound throughput: %.2f Mit/s, median cancellation latency: %s" % \
+                    (backend, n / duration / 1e6,
+                     ", ".join(["%s: %s" % (k, "%.2fms" % (v * 1e3) if v is not None else "not cancellable") \
+                                    for k, v in latencies.items()])))
+
+    return results
+
+def cancel_latency(repeats = 20):
+    """ Time between the call to RobotAction.cancel() and the exit of the
+    action thread, for a sleeping action, a CPU-bound action, and an action
+    waiting for a resource.
+    """
+    results = {}
+
+    with BenchRobot() as robot:
+        for kind in ["sleeping", "cpu-bound", "resource-waiting"]:
+            latencies = []
+            for i in range(repeats):
+                stop = threading.Event()
+                release = Future()
+                if kind == "sleeping":
+                    a = robot.wait_for(stop)
+                elif kind == "cpu-bound":
+                    a = robot.crunch_until(stop)
+                else:
+                    holder = robot.hold(release)
+                    a = robot.locked_noop()
+                time.sleep(0.02)
+
+                thread = a.thread()
+                start = time.time()
+                a.cancel()
+                thread.join()
+                latencies.append(time.time() - start)
+
+                stop.set()
+                release.set_result(None)
+                if kind == "resource-waiting":
+                    holder.wait()
+
+            results[kind] = _summary(latencies)
+            print("%16s: %s" % (kind, _ms(results[kind])))
+
+    return results
+
+def nested_cancel(depths = range(1, 11), repeats = 10):
+    """ Time taken by RobotAction.cancel() on the root of a chain of nested
+    sub-actions, depending on the depth of the chain.
+    """
+    results = {}
+
+    with BenchRobot() as robot:
+        for depth in depths:
+            latencies = []
+            for i in range(repeats):
+                release = Future()
+                root = robot.nest(depth, release)
+                while len(list(root.descendants())) < depth:
+                    time.sleep(0.001)
+
+                start = time.time()
+                root.cancel()
+                latencies.append(time.time() - start)
+                release.set_result(None)
+
+            results[depth] = _summary(latencies)
+            print("depth %2d: %s" % (depth, _ms(results[depth])))
+
+    return results
+
+def event_latency(repeats = 20):
+    """ Time between the update of the robot state and the execution of the
+    callback of an event monitor watching it, with the default (polling)
+    implementation of wait_for_state_update, and with a robot notifying its
+    state updates.
+    """
+    results = {}
+
+    for mode, cls in [("polling", BenchRobot), ("notifying", NotifyingBenchRobot)]:
+        kwargs = {"dummy": False} if cls is BenchRobot else {}
+        with cls(**kwargs) as robot:
+            latencies = []
+            for i in range(repeats):
+                robot.state["flag"] = False
+                stamps = []
+                monitor = robot.on("flag", value = True).do(lambda robot: robot.stamp(stamps))
+                time.sleep(0.02)
+
+                start = time.time()
+                if cls is BenchRobot:
+                    robot.state["flag"] = True
+                else:
+                    robot.update_state("flag", True)
+                monitor.thread.join()
+                latencies.append(stamps[0] - start)
+
+            results[mode] = _summary(latencies)
+            print("%10s: %s" % (mode, _ms(results[mode])))
+
+    return results
+
+def sleeping_footprint(n = 500, stack_sizes = (None, 256 * 1024)):
+    """ Number of threads and memory footprint of the process with ``n``
+    concurrent sleeping actions, with the default thread stack size and
+    with smaller stacks.
+    """
+    results = {}
+
+    for stack_size in stack_sizes:
+        with BenchRobot(max_actions = n + 10, stack_size = stack_size) as robot:
+            before = robots.concurrency.process_memory()
+            release = Future()
+            running = [robot.wait_future(release) for i in range(n)]
+            stats = robot.thread_stats()
+            release.set_result(None)
+            for a in running:
+                a.wait()
+
+        after = stats["process"]
+        mode = "%skB stacks" % (stack_size // 1024) if stack_size else "default stacks"
+        results[mode] = {"threads": stats["total"],
+                         "stack size": stats["stack size"],
+                         "stack memory": stats["stack memory"],
+                         "virtual": after["virtual"] - before["virtual"] if after else None,
+                         "resident": after["resident"] - before["resident"] if after else None}
+        print("%16s: %d threads, stacks: %s, process growth: %s virtual, %s resident" % \
+                (mode, stats["total"],
+                 "%.1fMB" % (stats["stack memory"] / 1e6) if stats["stack memory"] else "unknown",
+                 "%.1fMB" % (results[mode]["virtual"] / 1e6) if after else "unknown",
+                 "%.1fMB" % (results[mode]["resident"] / 1e6) if after else "unknown"))
+
+    return results
+
+def inline_calls(n = 2000):
+    """ Cost of a call to a trivial action (submission to result), executed
+    by its own thread and inline (``@action(inline=True)``).
+    """
+    results = {}
+
+    with BenchRobot() as robot:
+        for mode, call in [("thread", robot.noop), ("inline", robot.inline_noop)]:
+            start = time.time()
+            for i in range(n):
+                call().result()
+            results[mode] = (time.time() - start) / n
+            print("%6s: %.1fus per call" % (mode, results[mode] * 1e6))
+
+    return results
+
+def profiler_overhead(n = 1000000, rates = (100, 1000)):
+    """ Throughput of a CPU-bound action without profiling, under the
+    sampling profiler at several rates, and under cProfile.
+    """
+    results = {}
+
+    with BenchRobot() as robot:
+        modes = [("none", None, robot.crunch)]
+        modes += [("sampling %sHz" % rate, rate, robot.crunch) for rate in rates]
+        modes += [("cProfile", None, robot.crunch_cprofile)]
+
+        for mode, rate, fn in modes:
+            if rate:
+                robot.executor.start_profiler(rate)
+            duration = fn(n).result()
+            if rate:
+                robot.executor.stop_profiler()
+
+            results[mode] = n / duration
+            print("%16s: CPU-bound throughput: %.2f Mit/s" % (mode, n / duration / 1e6))
+
+    return results
+
+
+BENCHMARKS = [nested_submit, startup_latency, cancellation_backends,
+              cancel_latency, nested_cancel, event_latency, sleeping_footprint,
+              inline_calls, profiler_overhead]
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for pyRobots.')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='benchmarks to run (default: all of them)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to FILE, as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for bench in BENCHMARKS:
+        if not args.benchmarks or bench.__name__ in args.benchmarks:
+            print("## %s" % bench.__name__)
+            try:
+                results[bench.__name__] = bench()
+            except Exception as e:
+                # keep going: the results of the other benchmarks are
+                # still worth recording
+                traceback.print_exc()
+                results[bench.__name__] = {"error": "%s: %s" % (type(e).__name__, e)}
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"python": sys.version.split()[0],
+                       "platform": platform.platform(),
+                       "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results},
+                      output, indent = 2, sort_keys = True)
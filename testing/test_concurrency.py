@@ -0,0 +1,1214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import Future
+import time
+import logging
+import unittest
+import robots
+from robots.concurrency import action, ActionCancelled, ActionRejected, SignalingThread, ProgressQueue, wait
+from robots.concurrency import RobotAction, RobotActionExecutor, SimulatedClock, set_clock
+from robots.resources import Resource, lock, wait_stats, reset_wait_stats
+from robots.concurrency.processes import shared_array
+
+RES = Resource("test resource")
+RES2 = Resource("contended resource")
+RES3 = Resource("other resource")
+
+@action
+def sleeping(robot, duration):
+    robot.sleep(duration)
+    return duration
+
+@action
+def nested(robot, duration):
+    return robot.sleeping(duration).result()
+
+@action
+def current(robot):
+    return robot.executor.get_current_action()
+
+@action
+def compute(robot):
+    try:
+        while True:
+            sum(i * i for i in range(100))
+    except ActionCancelled:
+        return "cancelled"
+
+@action(coroutine = True)
+def co_sleeping(robot, duration):
+    yield duration
+    raise StopIteration(duration)
+
+@action(coroutine = True)
+def co_nested(robot, duration):
+    res = yield robot.sleeping(duration)
+    res += yield robot.co_sleeping(duration)
+    raise StopIteration(res)
+
+@action(coroutine = True)
+def co_cancellable(robot):
+    try:
+        yield 10
+    except ActionCancelled:
+        raise StopIteration("cancelled")
+
+@action(coroutine = True)
+@lock(RES)
+def co_locking(robot, log, name):
+    log.append(name)
+    yield 0.05
+    log.append(name)
+
+@action(process = True)
+def in_process(robot, array, value):
+    import os
+    array[:] = value
+    return os.getpid(), array.sum()
+
+@action(process = True)
+def spin_in_process(robot):
+    while True:
+        pass
+
+@action
+@lock(RES2)
+def hold(robot, duration):
+    robot.sleep(duration)
+    return "done"
+
+@action
+@lock(RES3, wait = False)
+def try_hold(robot, duration):
+    robot.sleep(duration)
+
+@action
+@lock(RES2)
+def use_low(robot, log):
+    log.append("low")
+
+@action(priority = 5)
+@lock(RES2)
+def use_high(robot, log):
+    log.append("high")
+
+@action(priority = 10, preempt = True)
+@lock(RES2)
+def use_preempting(robot, log):
+    log.append("preempting")
+
+@action
+@lock(RES2)
+@lock(RES3)
+def use_both(robot):
+    pass
+
+@action
+def identity(robot, value, other = None):
+    return value
+
+@action
+def spawner(robot, n):
+    me = robot.executor.get_current_action()
+    for i in range(n):
+        robot.identity(i).wait()
+    return len(me.children)
+
+@action
+def stubborn(robot, stop):
+    while not stop.is_set():
+        try:
+            robot.sleep(0.01)
+        except ActionCancelled:
+            pass
+
+@action(timeout = 0.1)
+def bounded(robot, duration):
+    robot.sleeping(duration).wait()
+    return "completed"
+
+@action
+def wait_both(robot, d1, d2):
+    return robot.wait_all(robot.sleeping(d1), robot.sleeping(d2))
+
+@action
+def counting(robot, n):
+    for i in range(n):
+        robot.sleep(0.01)
+        yield i
+    raise StopIteration("done")
+
+@action(progress_buffer = 2, progress_policy = ProgressQueue.BLOCK)
+def counting_blocking(robot, n):
+    for i in range(n):
+        yield i
+    raise StopIteration("done")
+
+@action(progress_buffer = 2)
+def counting_fast(robot, n):
+    for i in range(n):
+        yield i
+
+@action
+def chain(robot, depth):
+    if depth == 0:
+        return 0
+    return robot.chain(depth - 1).result() + 1
+
+@action
+def nest(robot, depth, release):
+    if depth == 0:
+        wait(release)
+    else:
+        robot.nest(depth - 1, release).wait()
+
+@action
+def polling(robot, target, n):
+    for i in range(n):
+        wait(target, 0.001)
+
+@action
+def ticking(robot, ticks):
+    while True:
+        ticks.append(time.time())
+        robot.sleep(0.01)
+
+@action
+def nested_ticking(robot, ticks):
+    robot.ticking(ticks).wait()
+
+@action
+@lock(RES2)
+def locked_ticking(robot, ticks):
+    robot.ticking(ticks).wait()
+
+@action
+def spinning(robot, counter):
+    while True:
+        counter[0] += 1
+
+@action(inline = True)
+def inline_get(robot, value):
+    if value is None:
+        raise ValueError("no value")
+    return value
+
+@action(inline = True)
+def inline_spinning(robot, counter):
+    while True:
+        counter[0] += 1
+
+@action
+def calling_inline(robot, counter):
+    robot.inline_spinning(counter)
+
+@action(coalesce = RobotActionExecutor.JOIN)
+def joining(robot, target):
+    robot.sleep(0.1)
+    return target
+
+@action(coalesce = RobotActionExecutor.REPLACE)
+def replacing(robot, target):
+    robot.sleep(0.1)
+    return target
+
+@action(coalesce = RobotActionExecutor.DROP)
+def dropping(robot, target):
+    robot.sleep(0.1)
+    return target
+
+class DummyRobot(robots.GenericRobot):
+
+    def __init__(self, **kwargs):
+        super(DummyRobot, self).__init__(actions=[sleeping, nested, current, compute, chain, nest, polling,
+                                                  co_sleeping, co_nested, co_cancellable, co_locking,
+                                                  in_process, spin_in_process,
+                                                  hold, try_hold, use_low, use_high, use_preempting, use_both,
+                                                  identity, spawner, stubborn, bounded,
+                                                  wait_both, counting, counting_blocking, counting_fast,
+                                                  ticking, nested_ticking, locked_ticking, spinning,
+                                                  inline_get, inline_spinning, calling_inline,
+                                                  joining, replacing, dropping],
+                                         dummy = True,
+                                         configure_logging = False,
+                                         **kwargs)
+        self.loglevel(logging.WARNING)
+
+
+class PooledExecutorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot(pool_size = 4)
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_workers_are_reused(self):
+        self.assertEqual(self.robot.sleeping(0.01).result(), 0.01)
+        self.assertEqual(self.robot.nested(0.01).result(), 0.01)
+
+        stats = self.robot.executor.pool_stats()
+        self.assertEqual(stats["size"], 4)
+        self.assertEqual(stats["queued"], 0)
+
+    def test_current_action(self):
+        a = self.robot.current()
+        self.assertTrue(a.result() is a)
+
+    def test_queueing_and_cancellation(self):
+        actions = [self.robot.sleeping(0.5) for i in range(6)]
+        time.sleep(0.1)
+
+        stats = self.robot.executor.pool_stats()
+        self.assertEqual(stats["idle"], 0)
+        self.assertEqual(stats["queued"], 2)
+
+        for a in actions:
+            a.cancel()
+
+        for a in actions:
+            self.assertTrue(a.done())
+
+        # the workers survive the cancellation of their actions
+        self.assertEqual(self.robot.sleeping(0.01).result(), 0.01)
+
+
+class WaitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_no_polling_delay(self):
+        # each level used to wait up to 100ms for its child
+        start = time.time()
+        self.assertEqual(self.robot.chain(10).result(), 10)
+        self.assertLess(time.time() - start, 0.3)
+
+    def test_timeout(self):
+        from concurrent.futures import TimeoutError
+        a = self.robot.sleeping(1)
+        self.assertRaises(TimeoutError, a.result, 0.05)
+        a.cancel()
+
+    def test_repeated_timeouts(self):
+        # polling a long-running action does not accumulate callbacks on it
+        from concurrent.futures import TimeoutError
+        a = self.robot.sleeping(5)
+        nb_callbacks = len(a._done_callbacks)
+        for i in range(200):
+            self.assertRaises(TimeoutError, a.result, 0.001)
+            self.assertFalse(wait(a, 0.001))
+        self.robot.polling(a, 200).wait() # from an action
+        self.assertEqual(len(a._done_callbacks), nb_callbacks + 1) # the waiters' hook
+        self.assertEqual(a._completion_waiters.callbacks, [])
+        a.cancel()
+
+    def test_cancel_while_waiting(self):
+        a = self.robot.nested(5)
+        time.sleep(0.1)
+        start = time.time()
+        a.cancel()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertTrue(a.done())
+
+
+class RegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_registry(self):
+        executor = self.robot.executor
+        a = self.robot.sleeping(0.2)
+        time.sleep(0.05)
+        self.assertTrue(executor.futures[id(a)] is a)
+        self.assertEqual(executor.nb_active, 1)
+        self.assertTrue(str(a) in executor.actioninfo(id(a)))
+
+        a.wait()
+        time.sleep(0.01) # done callbacks run right after completion
+        self.assertEqual(executor.futures, {})
+        self.assertEqual(executor.nb_active, 0)
+
+    def test_cancel_all(self):
+        actions = [self.robot.sleeping(5) for i in range(5)]
+        time.sleep(0.05)
+        self.assertEqual(self.robot.cancel_all(), [])
+        self.assertTrue(all(a.done() for a in actions))
+        time.sleep(0.01) # done callbacks run right after completion
+        self.assertEqual(self.robot.executor.futures, {})
+
+    def test_cancel_all_deadline(self):
+        import threading
+        stop = threading.Event()
+        stubborn = [self.robot.stubborn(stop) for i in range(5)]
+        actions = [self.robot.sleeping(5) for i in range(5)]
+        time.sleep(0.05)
+
+        start = time.time()
+        stuck = self.robot.executor.cancel_all(timeout = 0.2)
+        # one deadline for all the actions
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(set(id(a) for a in stuck), set(id(a) for a in stubborn))
+        self.assertTrue(all(a.done() for a in actions))
+
+        stop.set()
+        for a in stubborn:
+            a.wait()
+
+
+class NamingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_lazy_names(self):
+        import numpy
+        a = self.robot.identity(numpy.zeros((100, 200)), other = "x" * 1000)
+        a.wait()
+        # nobody needed the name so far
+        self.assertEqual(a._actionname, None)
+
+        self.assertEqual(a.actionname, "identity(<ndarray 100x200>, other=%s...)" % ("x" * 27))
+        self.assertTrue(a.actionname is a.actionname) # cached
+
+    def test_thread_status(self):
+        a = self.robot.sleeping(0.2)
+        time.sleep(0.05)
+        self.assertEqual(a.thread().name, "Robot Action %s (running)" % a)
+        a.wait()
+
+
+class ActionTreeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_tree(self):
+        a = self.robot.nested(0.5)
+        time.sleep(0.1)
+        self.assertEqual(self.robot.executor.roots(), [a])
+
+        tree = a.tree()
+        self.assertTrue(tree["action"] is a)
+        self.assertEqual(len(tree["children"]), 1)
+        child = tree["children"][0]["action"]
+        self.assertTrue(child.childof(a))
+        self.assertFalse(a.childof(child))
+        self.assertEqual([(d, c) for d, c in a.descendants()], [(1, child)])
+
+        start = time.time()
+        a.cancel()
+        self.assertLess(time.time() - start, 0.2)
+        self.assertTrue(child.done())
+
+    def test_pruning(self):
+        # completed children are unlinked (the last one may still be
+        # unlinking when the parent returns)
+        self.assertLessEqual(self.robot.spawner(50).result(), 1)
+
+    def test_cancel_while_submitting(self):
+        # sub-actions submitted while their parent is being cancelled are
+        # cancelled as well
+        for i in range(50):
+            a = self.robot.nest(5, Future())
+            time.sleep(0.001 * (i % 5))
+            a.cancel()
+
+        time.sleep(0.2)
+        self.assertEqual(len(self.robot.executor.futures), 0)
+
+
+class TimeoutTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_timeout(self):
+        self.assertEqual(self.robot.bounded(0.01).result(), "completed")
+
+        start = time.time()
+        a = self.robot.bounded(5)
+        self.assertEqual(a.result(), None) # cancelled
+        self.assertLess(time.time() - start, 0.3)
+        self.assertTrue(a.timed_out)
+
+        self.assertEqual(self.robot.executor.timeout_stats(),
+                         {"total": 1, "actions": {"bounded": 1}})
+
+    def test_set_timeout(self):
+        a = self.robot.bounded(0.3)
+        a.set_timeout(1)
+        self.assertEqual(a.result(), "completed")
+
+        a = self.robot.sleeping(5)
+        a.set_timeout(0.1)
+        a.wait()
+        self.assertTrue(a.timed_out)
+
+        a = self.robot.bounded(0.2)
+        a.set_timeout(None)
+        self.assertEqual(a.result(), "completed")
+        self.assertFalse(a.timed_out)
+
+    def test_failed_expiry(self):
+        # an error while cancelling a timed out action does not stop the
+        # deadline timer
+        def broken():
+            raise RuntimeError("broken action")
+        a = self.robot.sleeping(5)
+        a.signal_cancel = broken
+        a.set_timeout(0.05)
+
+        b = self.robot.sleeping(5)
+        b.set_timeout(0.1)
+        logging.getLogger("robots.actions").disabled = True
+        try:
+            b.wait()
+        finally:
+            logging.getLogger("robots.actions").disabled = False
+        self.assertTrue(b.timed_out)
+        self.assertTrue(a.timed_out)
+        a.interrupt()
+
+
+class CombinatorsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_wait_all(self):
+        start = time.time()
+        self.assertEqual(self.robot.wait_all(self.robot.sleeping(0.1), self.robot.sleeping(0.05)),
+                         [0.1, 0.05])
+        self.assertLess(time.time() - start, 0.2)
+
+        from concurrent.futures import TimeoutError
+        a = self.robot.sleeping(1)
+        self.assertRaises(TimeoutError, self.robot.wait_all, a, timeout = 0.05)
+        a.cancel()
+
+    def test_wait_any(self):
+        slow = self.robot.sleeping(1)
+        fast = self.robot.sleeping(0.05)
+        self.assertTrue(self.robot.wait_any(slow, fast) is fast)
+
+        # supervisor loop: the successive waits do not accumulate callbacks
+        # on the slow action
+        nb_callbacks = len(slow._done_callbacks)
+        for i in range(10):
+            self.assertTrue(self.robot.wait_any(slow, self.robot.identity(i)) is not slow)
+        self.assertEqual(len(slow._done_callbacks), nb_callbacks)
+        self.assertEqual(slow._completion_waiters.callbacks, [])
+        slow.cancel()
+
+    def test_as_completed(self):
+        actions = [self.robot.sleeping(d) for d in [0.15, 0.05, 0.1]]
+        self.assertEqual([a.result() for a in self.robot.as_completed(*actions)],
+                         [0.05, 0.1, 0.15])
+
+    def test_from_action(self):
+        self.assertEqual(self.robot.wait_both(0.05, 0.1).result(), [0.05, 0.1])
+
+        a = self.robot.wait_both(5, 5)
+        time.sleep(0.1)
+        start = time.time()
+        a.cancel()
+        self.assertLess(time.time() - start, 0.2)
+
+
+class ProgressTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_progress(self):
+        a = self.robot.counting(5)
+        self.assertEqual(list(a.progress()), range(5))
+        self.assertEqual(a.result(), "done")
+
+        self.assertRaises(RuntimeError, self.robot.sleeping(0.01).progress)
+
+    def test_policies(self):
+        a = self.robot.counting_blocking(10)
+        time.sleep(0.1)
+        self.assertFalse(a.done()) # waiting for a consumer
+        self.assertEqual(list(a.progress()), range(10))
+        self.assertEqual(a.result(), "done")
+
+        a = self.robot.counting_fast(10)
+        a.wait()
+        self.assertEqual(list(a.progress()), [8, 9])
+
+    def test_cancellation(self):
+        a = self.robot.counting_blocking(10)
+        time.sleep(0.05)
+        start = time.time()
+        a.cancel()
+        self.assertLess(time.time() - start, 0.1)
+
+        a = self.robot.counting(1000)
+        progress = a.progress()
+        next(progress)
+        a.cancel()
+        self.assertLess(len(list(progress)), 1000)
+
+
+class CancellationBackendsTests(unittest.TestCase):
+
+    def check_cancel_sleeping(self, robot):
+        a = robot.nested(5)
+        time.sleep(0.1)
+        start = time.time()
+        a.cancel()
+        self.assertLess(time.time() - start, 0.2)
+
+    def test_trace(self):
+        with DummyRobot(cancellation = SignalingThread.TRACE) as robot:
+            self.check_cancel_sleeping(robot)
+
+            a = robot.compute()
+            time.sleep(0.1)
+            a.cancel()
+            self.assertEqual(a.result(), "cancelled")
+
+    def test_async(self):
+        with DummyRobot(cancellation = SignalingThread.ASYNC) as robot:
+            self.check_cancel_sleeping(robot)
+
+            a = robot.compute()
+            time.sleep(0.1)
+            a.cancel()
+            self.assertEqual(a.result(), "cancelled")
+
+            # the thread keeps working after handling the signal
+            self.assertEqual(robot.sleeping(0.01).result(), 0.01)
+
+    def test_cooperative(self):
+        with DummyRobot(cancellation = SignalingThread.COOPERATIVE) as robot:
+            self.check_cancel_sleeping(robot)
+
+
+class CoroutineActionsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_coroutines(self):
+        start = time.time()
+        actions = [self.robot.co_sleeping(0.1) for i in range(20)]
+        self.assertEqual([a.result() for a in actions], [0.1] * 20)
+        self.assertLess(time.time() - start, 0.5)
+
+        self.assertEqual(self.robot.co_nested(0.05).result(), 0.1)
+
+    def test_cancellation(self):
+        a = self.robot.co_cancellable()
+        time.sleep(0.05)
+        a.cancel()
+        self.assertEqual(a.result(), "cancelled")
+
+    def test_resources(self):
+        log = []
+        a = self.robot.co_locking(log, "a")
+        b = self.robot.co_locking(log, "b")
+        a.wait(); b.wait()
+        self.assertEqual(log, ["a", "a", "b", "b"])
+
+    def test_resources_handover(self):
+        log = []
+        start = time.time()
+        a = self.robot.co_locking(log, "a")
+        time.sleep(0.01)
+        b = self.robot.co_locking(log, "b")
+        c = self.robot.co_locking(log, "c")
+        time.sleep(0.01)
+        # queued with the other waiters, instead of polling the resource
+        self.assertEqual(len(RES.waiters), 2)
+
+        c.cancel()
+        a.wait(); b.wait()
+        self.assertLess(time.time() - start, 0.15) # handed over as soon as released
+        self.assertEqual(log, ["a", "a", "b", "b"])
+        self.assertFalse(RES.locked)
+
+
+class ProcessActionsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_process(self):
+        import os
+        array = shared_array((10,))
+        pid, total = self.robot.in_process(array, 2.).result()
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(total, 20.)
+        # zero-copy: the worker wrote in our array
+        self.assertEqual(array.sum(), 20.)
+
+    def test_cancellation(self):
+        a = self.robot.spin_in_process()
+        time.sleep(0.2)
+        a.cancel()
+        self.assertTrue(a.done())
+
+        array = shared_array((2,))
+        self.assertEqual(self.robot.in_process(array, 1.).result()[1], 2.)
+
+
+class PriorityTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_priority(self):
+        reset_wait_stats()
+        log = []
+        holder = self.robot.hold(0.2)
+        time.sleep(0.05)
+        low = self.robot.use_low(log)
+        time.sleep(0.02)
+        high = self.robot.use_high(log)
+
+        low.wait(); high.wait()
+        self.assertEqual(holder.result(), "done")
+        self.assertEqual(log, ["high", "low"])
+
+        stats = wait_stats()
+        self.assertEqual(stats[5]["count"], 1)
+        self.assertGreater(stats[5]["max"], 0.1)
+
+    def test_preemption(self):
+        log = []
+        holder = self.robot.hold(5)
+        time.sleep(0.05)
+        start = time.time()
+        self.robot.use_preempting(log).wait()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(log, ["preempting"])
+        self.assertEqual(holder.result(), None) # cancelled
+
+    def test_preemption_cancels_subactions(self):
+        ticks = []
+        holder = self.robot.locked_ticking(ticks)
+        time.sleep(0.05)
+        self.robot.use_preempting([]).wait()
+        holder.wait()
+        time.sleep(0.05)
+        nb_ticks = len(ticks)
+        time.sleep(0.1)
+        self.assertEqual(len(ticks), nb_ticks)
+
+    def test_release_on_cancel(self):
+        holder = self.robot.hold(5)
+        time.sleep(0.05)
+        a = self.robot.use_both() # acquires RES3, then waits for RES2
+        time.sleep(0.05)
+        self.assertTrue(RES3.locked)
+        a.cancel()
+        holder.cancel()
+        self.assertFalse(RES2.locked)
+        self.assertFalse(RES3.locked)
+
+class AdmissionTests(unittest.TestCase):
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_reject(self):
+        self.robot = DummyRobot(max_actions = 2)
+        a, b = self.robot.sleeping(0.1), self.robot.sleeping(0.1)
+        time.sleep(0.02) # only running actions count
+        self.assertRaises(ActionRejected, self.robot.sleeping, 0.1)
+
+        # sub-actions are always admitted
+        self.robot.executor.max_actions = 1
+        a.wait(); b.wait()
+        time.sleep(0.01)
+        self.assertEqual(self.robot.nested(0.05).result(), 0.05)
+
+        self.robot.executor.max_actions = 2
+        self.assertEqual(self.robot.sleeping(0.01).result(), 0.01)
+        self.assertEqual(self.robot.executor.admission_stats()["rejected"], 1)
+
+    def test_queue(self):
+        self.robot = DummyRobot(max_actions = 1, admission = RobotActionExecutor.QUEUE, max_queued = 2)
+        a = self.robot.sleeping(0.2)
+        time.sleep(0.02)
+        b, c = self.robot.identity(1), self.robot.identity(2)
+        self.assertFalse(b.running() or b.done())
+        self.assertRaises(ActionRejected, self.robot.identity, 3)
+        self.assertEqual(self.robot.executor.admission_stats()["queued"], 2)
+
+        self.assertEqual([b.result(), c.result()], [1, 2])
+        self.assertTrue(a.done())
+
+        stats = self.robot.executor.admission_stats()
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["max_queued"], 2)
+        self.assertEqual(stats["wait"]["count"], 2)
+        self.assertGreater(stats["wait"]["max"], 0.05)
+
+    def test_drop_oldest(self):
+        self.robot = DummyRobot(max_actions = 1, admission = RobotActionExecutor.DROP_OLDEST, max_queued = 1)
+        self.robot.sleeping(0.1)
+        time.sleep(0.02)
+        b = self.robot.identity(1)
+        c = self.robot.identity(2)
+        self.assertTrue(b.cancelled())
+        self.assertEqual(c.result(), 2)
+        self.assertEqual(self.robot.executor.admission_stats()["dropped"], 1)
+
+    def test_cancel_queued_coroutine(self):
+        self.robot = DummyRobot(max_actions = 1, admission = RobotActionExecutor.QUEUE)
+        a = self.robot.sleeping(0.5)
+        time.sleep(0.02)
+        c = self.robot.co_sleeping(0.1)
+        self.assertFalse(c.running() or c.done())
+        c.cancel()
+        self.assertTrue(c.cancelled())
+
+        c = self.robot.co_sleeping(0.1)
+        self.assertEqual(self.robot.cancel_all(), [])
+        self.assertTrue(c.done() and a.done())
+
+    def test_resource_waits_not_counted(self):
+        self.robot = DummyRobot(max_actions = 2)
+        log = []
+        holder = self.robot.hold(0.2)
+        time.sleep(0.05)
+        waiting = [self.robot.use_low(log) for i in range(5)]
+        time.sleep(0.05)
+        self.assertEqual(self.robot.executor.admission_stats()["active"], 1)
+
+        self.assertEqual(holder.result(), "done")
+        for a in waiting:
+            a.wait()
+        self.assertEqual(log, ["low"] * 5)
+
+    def test_release_when_not_started(self):
+        self.robot = DummyRobot(max_actions = 1, admission = RobotActionExecutor.DROP_OLDEST, max_queued = 1)
+        a = self.robot.sleeping(0.1)
+        time.sleep(0.02)
+
+        b = self.robot.try_hold(0) # queued
+        self.assertTrue(RES3.locked)
+        self.robot.identity(1) # drops b
+        self.assertTrue(b.cancelled())
+        self.assertFalse(RES3.locked)
+        a.wait()
+        time.sleep(0.02)
+
+        self.robot.executor.admission = RobotActionExecutor.REJECT
+        a = self.robot.sleeping(0.1)
+        time.sleep(0.02)
+        self.assertRaises(ActionRejected, self.robot.try_hold, 0)
+        self.assertFalse(RES3.locked)
+        a.wait()
+        time.sleep(0.01)
+        self.robot.try_hold(0).wait()
+        self.assertFalse(RES3.locked)
+
+class LifecycleStatsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_phases(self):
+        holder = self.robot.hold(0.1)
+        time.sleep(0.01)
+        self.robot.use_low([]).wait()
+        holder.wait()
+
+        a = self.robot.sleeping(5)
+        time.sleep(0.01)
+        a.cancel()
+        time.sleep(0.01)
+
+        stats = self.robot.action_stats()
+        self.assertEqual(stats["hold"]["run"]["count"], 1)
+        self.assertGreaterEqual(stats["hold"]["run"]["min"], 0.1)
+        self.assertGreater(stats["use_low"]["resource wait"]["min"], 0.05)
+        self.assertEqual(stats["use_low"]["cancel"]["count"], 0)
+        self.assertEqual(stats["sleeping"]["cancel"]["count"], 1)
+        self.assertLess(stats["sleeping"]["cancel"]["max"], 0.5)
+
+        run = self.robot.action_stats("hold")["run"]
+        self.assertGreaterEqual(run["p50"], run["min"])
+        self.assertEqual(sum(run["buckets"].values()), 1)
+        self.assertEqual(self.robot.action_stats("unknown"), None)
+
+class PauseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def assertPaused(self, ticks):
+        nb = len(ticks)
+        time.sleep(0.05)
+        self.assertEqual(len(ticks), nb)
+
+    def test_pause_resume(self):
+        ticks = []
+        a = self.robot.ticking(ticks)
+        time.sleep(0.05)
+        self.assertTrue(a.pause())
+        self.assertTrue(a.paused)
+        self.assertPaused(ticks)
+
+        a.resume()
+        time.sleep(0.05)
+        self.assertFalse(a.paused)
+        self.assertGreater(len(ticks), 1)
+
+        stats = self.robot.executor.pause_stats()
+        self.assertEqual(stats["pause"]["count"], 1)
+        self.assertEqual(stats["resume"]["count"], 1)
+        self.assertLess(stats["resume"]["max"], 0.05)
+
+        # cancelling a paused action
+        a.pause()
+        start = time.time()
+        a.cancel()
+        self.assertLess(time.time() - start, 0.1)
+        self.assertTrue(a.done())
+
+    def test_pause_subactions(self):
+        ticks = []
+        a = self.robot.locked_ticking(ticks)
+        time.sleep(0.05)
+        self.assertTrue(a.pause())
+        self.assertTrue(a.subactions[0].paused)
+        self.assertPaused(ticks)
+        self.assertTrue(RES2.locked) # resources are kept
+
+        a.resume()
+        nb = len(ticks)
+        time.sleep(0.05)
+        self.assertGreater(len(ticks), nb)
+        a.cancel()
+        self.assertFalse(RES2.locked)
+
+    def test_pause_cpu_bound(self):
+        counter = [0]
+        a = self.robot.spinning(counter)
+        time.sleep(0.02)
+        self.assertTrue(a.pause())
+        value = counter[0]
+        time.sleep(0.02)
+        self.assertEqual(counter[0], value)
+        a.resume()
+        time.sleep(0.02)
+        self.assertGreater(counter[0], value)
+        a.cancel()
+
+    def test_cooperative(self):
+        self.robot.close()
+        self.robot = DummyRobot(cancellation = SignalingThread.COOPERATIVE)
+        ticks = []
+        a = self.robot.nested_ticking(ticks)
+        time.sleep(0.05)
+        self.assertTrue(a.pause())
+        self.assertPaused(ticks)
+        a.resume()
+        nb = len(ticks)
+        time.sleep(0.05)
+        self.assertGreater(len(ticks), nb)
+        a.cancel()
+
+class ThreadStatsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot(stack_size = 256 * 1024)
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_thread_stats(self):
+        actions = [self.robot.sleeping(0.2) for i in range(5)]
+        self.robot.state["flag"] = False
+        self.robot.on("flag", value = True).do(lambda robot: robot.identity(1))
+
+        stats = self.robot.thread_stats()
+        self.assertEqual(stats["types"]["RobotActionThread"], 5)
+        self.assertEqual(stats["types"]["SignalingThread"], 1) # event monitor
+        self.assertEqual(stats["stack size"], 256 * 1024)
+        self.assertEqual(stats["stack memory"], stats["total"] * 256 * 1024)
+
+        for a in actions:
+            a.wait()
+        time.sleep(0.05)
+        self.assertNotIn("RobotActionThread", self.robot.thread_stats()["types"])
+
+    def test_invalid_stack_size(self):
+        self.assertRaises(ValueError, DummyRobot, stack_size = 1024)
+
+class InlineActionsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_inline(self):
+        a = self.robot.inline_get(42)
+        self.assertTrue(isinstance(a, RobotAction))
+        self.assertTrue(a.done())
+        self.assertEqual(a.result(), 42)
+        self.assertEqual(self.robot.executor.futures, {})
+        self.assertEqual(str(a), "inline_get(42)[%s]" % a.id)
+
+        a = self.robot.inline_get(None)
+        self.assertRaises(ValueError, a.result)
+        self.assertTrue(isinstance(a.exception(), ValueError))
+        self.assertTrue(next(self.robot.as_completed(a)) is a)
+
+    def test_cancel_enclosing_action(self):
+        counter = [0]
+        a = self.robot.calling_inline(counter)
+        time.sleep(0.05)
+        self.assertGreater(counter[0], 0)
+        a.cancel()
+        self.assertTrue(a.done())
+        count = counter[0]
+        time.sleep(0.05)
+        self.assertEqual(counter[0], count)
+
+    def test_no_resources(self):
+        def locked(robot):
+            pass
+        self.assertRaises(TypeError, action(inline = True), lock(RES)(locked))
+
+class CoalescingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_join(self):
+        a = self.robot.joining("person")
+        b = self.robot.joining("person")
+        c = self.robot.joining(target = "person")
+        other = self.robot.joining("door")
+        self.assertTrue(a is b)
+        self.assertFalse(a is c or a is other)
+        self.assertEqual(b.result(), "person")
+        self.assertEqual(other.result(), "door")
+
+        # not running anymore: new call
+        time.sleep(0.01)
+        self.assertFalse(self.robot.joining("person") is a)
+
+        # unhashable arguments: not coalesced
+        self.assertFalse(self.robot.joining(["person"]) is self.robot.joining(["person"]))
+        self.assertEqual(self.robot.executor.coalescing_stats()["join"], 1)
+
+    def test_replace(self):
+        a = self.robot.replacing("person")
+        time.sleep(0.02)
+        b = self.robot.replacing("person")
+        self.assertFalse(a is b)
+        self.assertEqual(b.result(), "person")
+        self.assertTrue(a.done())
+        self.assertEqual(a.result(), None) # cancelled
+
+    def test_drop(self):
+        a = self.robot.dropping("person")
+        b = self.robot.dropping("person")
+        self.assertTrue(b.done())
+        self.assertEqual(b.result(), None)
+        self.assertEqual(a.result(), "person")
+        self.assertEqual(self.robot.executor.coalescing_stats(),
+                         {"join": 0, "replace": 0, "drop": 1, "running": 0})
+
+class ScopeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_scope(self):
+        outside = self.robot.sleeping(0.3)
+        start = time.time()
+        with self.robot.scope() as scope:
+            a = self.robot.sleeping(5)
+            b = self.robot.nested(5)
+            self.assertEqual(self.robot.identity(1).result(), 1)
+            time.sleep(0.05)
+            subactions = b.subactions
+            self.assertEqual(len(subactions), 1)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertTrue(a.done() and b.done() and subactions[0].done())
+        self.assertEqual(scope.stuck, [])
+        self.assertEqual(scope.live_actions(), [])
+
+        self.assertFalse(outside.done())
+        self.assertEqual(outside.result(), 0.3)
+
+    def test_nested(self):
+        with self.robot.scope():
+            a = self.robot.sleeping(5)
+            with self.robot.scope():
+                b = self.robot.sleeping(5)
+            self.assertTrue(b.done())
+            self.assertFalse(a.done())
+        self.assertTrue(a.done())
+
+    def test_exception(self):
+        try:
+            with self.robot.scope():
+                a = self.robot.sleeping(5)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue(a.done())
+
+class ProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+
+    def test_profiling(self):
+        with self.robot.profiling(rate = 500) as profiler:
+            self.robot.nested(0.2).wait()
+        self.assertFalse(profiler.is_alive())
+        self.assertEqual(self.robot.executor.profiler, None)
+
+        stats = profiler.stats()
+        self.assertGreater(stats["ticks"], 20)
+        self.assertGreater(stats["actions"]["nested"], 0)
+        self.assertGreater(stats["actions"]["sleeping"], 0)
+        self.assertLess(stats["overhead"], 0.5)
+
+        lines = profiler.collapsed().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertTrue(stack.split(";")[0] in ["nested", "sleeping"])
+            self.assertGreater(int(count), 0)
+        self.assertTrue([l for l in lines if l.startswith("sleeping;") and "sleeping (test_concurrency.py)" in l])
+
+    def test_rate(self):
+        self.assertRaises(ValueError, self.robot.executor.start_profiler, -1)
+
+    def test_prompt_stop(self):
+        # stopping does not wait for the next tick
+        profiler = self.robot.executor.start_profiler(rate = 0.2)
+        time.sleep(0.05)
+        start = time.time()
+        self.robot.executor.stop_profiler()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertFalse(profiler.is_alive())
+
+class SimulatedClockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.previous_clock = set_clock(self.clock)
+        self.robot = DummyRobot()
+
+    def tearDown(self):
+        self.robot.close()
+        set_clock(self.previous_clock)
+
+    def test_virtual_time(self):
+        start = time.time()
+        with self.clock.participate():
+            a = self.robot.sleeping(600)
+            b = self.robot.nested(300)
+            self.robot.sleep(10)
+            self.assertEqual(self.clock.time(), 10)
+            self.assertFalse(a.done())
+
+            self.assertEqual(b.result(), 300)
+            self.assertEqual(self.clock.time(), 300)
+            self.assertFalse(a.done())
+            self.assertEqual(a.result(), 600)
+            self.assertEqual(self.clock.time(), 600)
+        self.assertLess(time.time() - start, 1)
+
+    def test_timeouts(self):
+        with self.clock.participate():
+            a = self.robot.bounded(5)
+            self.assertEqual(a.result(), None)
+            self.assertTrue(a.timed_out)
+            self.assertAlmostEqual(self.clock.time(), 0.1)
+
+            from concurrent.futures import TimeoutError
+            a = self.robot.sleeping(100)
+            self.assertRaises(TimeoutError, a.result, 10)
+            self.assertAlmostEqual(self.clock.time(), 10.1)
+            a.cancel()
+
+    def test_events(self):
+        with self.clock.participate():
+            log = []
+            self.robot.state["flag"] = False
+            self.robot.whenever("flag", value = True, max_firing_freq = 1).do(lambda robot: robot.identity(log.append(self.clock.time())))
+            self.robot.sleep(10)
+            # dummy mode: the monitor fires after 0.2s, then waits 1s (max_firing_freq)
+            self.assertEqual(len(log), 9)
+            self.assertAlmostEqual(log[-1], 9.8)
+
+    def test_pooled(self):
+        robot = DummyRobot(pool_size = 2)
+        try:
+            with self.clock.participate():
+                # more actions than workers: the third one starts when a
+                # worker is available
+                actions = [robot.sleeping(10) for i in range(3)]
+                for a in actions:
+                    a.wait()
+                self.assertEqual(self.clock.time(), 20)
+        finally:
+            robot.close()
+
+
+if __name__ == '__main__':
+    unittest.main()